@@ -0,0 +1,222 @@
+"""
+Contrôle d'admission des requêtes envoyées au backend.
+
+Chaque appel au backend prend une place parmi `max_concurrent` et un
+jeton dans deux seaux (global et par navigateur). Sans place ni jeton,
+la requête attend dans une file bornée, par ordre d'arrivée, et sa
+position est signalée à l'appelant ; file pleine ou attente trop longue,
+elle est refusée (AdmissionRejected) au lieu d'aggraver la surcharge.
+Un navigateur à court de jetons ne bloque pas ceux qui le suivent.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from metrics import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS, registry
+from tracing import span
+
+# Configuration de l'admission (0 : sans limite)
+ADMISSION_CONFIG = {
+    'max_concurrent': int(os.getenv('ADMISSION_MAX_CONCURRENT', 100)),
+    'queue_size': int(os.getenv('ADMISSION_QUEUE_SIZE', 500)),
+    'queue_timeout': float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 60.0)),  # secondes
+    # Seau global : requêtes par seconde et rafale maximale
+    'global_rate': float(os.getenv('ADMISSION_GLOBAL_RATE', 0.0)),
+    'global_burst': int(os.getenv('ADMISSION_GLOBAL_BURST', 50)),
+    # Seau par utilisateur
+    'user_rate': float(os.getenv('ADMISSION_USER_RATE', 0.0)),
+    'user_burst': int(os.getenv('ADMISSION_USER_BURST', 5))
+}
+
+
+class AdmissionRejected(Exception):
+    """Requête refusée : file d'attente pleine ou attente trop longue"""
+
+
+class TokenBucket:
+    """Seau à jetons : `rate` jetons par seconde, au plus `burst` (rate 0 : illimité)"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def ready(self, now) -> bool:
+        if not self.rate:
+            return True
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+    def wait_time(self, now) -> float:
+        """Secondes avant le prochain jeton"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class _Waiter:
+    """Requête en file d'attente"""
+
+    __slots__ = ('key', 'future', 'on_position', 'position')
+
+    def __init__(self, key, future, on_position):
+        self.key = key
+        self.future = future
+        self.on_position = on_position
+        self.position = 0
+
+    def notify(self, position):
+        """Signaler la position (0 : sortie de la file) si elle a changé"""
+        if position == self.position or self.on_position is None:
+            return
+        self.position = position
+        try:
+            self.on_position(position)
+        except Exception as e:
+            print(f"⚠️ Erreur d'affichage de la position dans la file : {type(e).__name__} - {str(e)}")
+
+
+class AdmissionController:
+    """Limite la concurrence et le débit des requêtes, avec une file d'attente bornée"""
+
+    def __init__(self, max_concurrent=ADMISSION_CONFIG['max_concurrent'],
+                 queue_size=ADMISSION_CONFIG['queue_size'], queue_timeout=ADMISSION_CONFIG['queue_timeout'],
+                 global_rate=ADMISSION_CONFIG['global_rate'], global_burst=ADMISSION_CONFIG['global_burst'],
+                 user_rate=ADMISSION_CONFIG['user_rate'], user_burst=ADMISSION_CONFIG['user_burst'],
+                 max_users=10000):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        # Seaux par utilisateur, LRU borné : un seau oublié repart plein
+        self._user_buckets = OrderedDict()
+        self.max_users = max_users
+        self._queue = deque()
+        self._in_flight = 0
+        self._timer = None
+
+    def _user_bucket(self, key):
+        bucket = self._user_buckets.get(key)
+        if bucket is None:
+            bucket = self._user_buckets[key] = TokenBucket(self.user_rate, self.user_burst)
+            while len(self._user_buckets) > self.max_users:
+                self._user_buckets.popitem(last=False)
+        else:
+            self._user_buckets.move_to_end(key)
+        return bucket
+
+    def _saturated(self):
+        return bool(self.max_concurrent) and self._in_flight >= self.max_concurrent
+
+    def _try_admit(self, key, now) -> bool:
+        """Prendre une place et les jetons nécessaires, si tous sont disponibles"""
+        if self._saturated() or not self.global_bucket.ready(now):
+            return False
+        user_bucket = self._user_bucket(key)
+        if not user_bucket.ready(now):
+            return False
+        self.global_bucket.take()
+        user_bucket.take()
+        self._in_flight += 1
+        return True
+
+    async def acquire(self, key, on_position=None):
+        """Attendre une place pour `key` ; `on_position(n)` reçoit la position dans la file (0 : sortie)"""
+        if not self._queue and self._try_admit(key, time.monotonic()):
+            return
+        if self.queue_size and len(self._queue) >= self.queue_size:
+            ADMISSION_REJECTED.inc(reason='queue_full')
+            raise AdmissionRejected("Service saturé, veuillez réessayer dans quelques instants")
+
+        waiter = _Waiter(key, asyncio.get_running_loop().create_future(), on_position)
+        self._queue.append(waiter)
+        self._wake()
+        start = time.perf_counter()
+        try:
+            with span('admission.wait'):
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout or None)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # Admise au moment même de l'expiration ou de l'annulation
+                if isinstance(e, asyncio.CancelledError):
+                    self.release()
+                    raise
+            else:
+                waiter.future.cancel()
+                self._queue.remove(waiter)
+                self._notify_positions()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                ADMISSION_REJECTED.inc(reason='timeout')
+                raise AdmissionRejected("Délai d'attente dépassé, veuillez réessayer dans quelques instants") from e
+        finally:
+            waiter.notify(0)
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+    def release(self):
+        """Libérer la place d'une requête terminée"""
+        self._in_flight -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, key, on_position=None):
+        """Bloc exécuté avec une place réservée pour `key`"""
+        await self.acquire(key, on_position)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _wake(self):
+        """Admettre les requêtes en attente dans l'ordre, tant que places et jetons le permettent"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        for waiter in list(self._queue):
+            if self._saturated() or not self.global_bucket.ready(now):
+                break
+            if self._try_admit(waiter.key, now):
+                self._queue.remove(waiter)
+                waiter.future.set_result(None)
+        self._notify_positions()
+
+        # Attente bloquée par les seaux seulement : réessayer au prochain jeton
+        if self._queue and not self._saturated():
+            delay = self.global_bucket.wait_time(now) or min(
+                self._user_bucket(waiter.key).wait_time(now) for waiter in self._queue
+            )
+            self._timer = asyncio.get_running_loop().call_later(max(delay, 0.01), self._wake)
+
+    def _notify_positions(self):
+        for position, waiter in enumerate(self._queue, start=1):
+            waiter.notify(position)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+
+# Admission partagée par toutes les sessions du serveur
+admission = AdmissionController()
+registry.gauge('chat_admission_in_flight', "Requêtes admises en cours", lambda: admission.in_flight)
+registry.gauge('chat_admission_queued', "Requêtes dans la file d'admission", lambda: admission.queued)
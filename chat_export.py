@@ -0,0 +1,70 @@
+"""
+Export de l'historique de conversation par morceaux.
+
+L'historique est sérialisé message par message par un générateur d'octets
+(texte, JSON Lines ou JSON Lines compressé en gzip) : aucune étape ne
+construit la conversation entière en mémoire sous forme de chaîne.
+"""
+
+import os
+import tempfile
+import zlib
+
+from codec import dumps
+
+# Taille au-delà de laquelle le fichier d'export est écrit sur disque
+EXPORT_SPOOL_SIZE = int(os.getenv('EXPORT_SPOOL_SIZE', 1024 * 1024))
+
+# Format -> (extension du fichier, compression gzip)
+EXPORT_FORMATS = {
+    'txt': ('txt', False),
+    'jsonl': ('jsonl', False),
+    'jsonl.gz': ('jsonl.gz', True)
+}
+
+
+def _iter_text(records):
+    for user, content in records:
+        yield f"{user}: {content}\n"
+
+
+def _iter_jsonl(records):
+    for user, content in records:
+        if not isinstance(content, str):
+            content = str(content)
+        yield dumps({'user': user, 'content': content}) + "\n"
+
+
+def iter_export(records, fmt='txt'):
+    """Produire l'export de `records` (couples (user, contenu)) par morceaux d'octets"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export inconnu : {fmt}")
+    _, compressed = EXPORT_FORMATS[fmt]
+    lines = _iter_text(records) if fmt == 'txt' else _iter_jsonl(records)
+
+    if not compressed:
+        for line in lines:
+            yield line.encode('utf-8')
+        return
+
+    # wbits=31 : flux au format gzip
+    compressor = zlib.compressobj(wbits=31)
+    for line in lines:
+        chunk = compressor.compress(line.encode('utf-8'))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def export_filename(basename, fmt):
+    """Nom du fichier d'export pour le format donné"""
+    return f"{basename}.{EXPORT_FORMATS[fmt][0]}"
+
+
+def export_file(records, fmt='txt'):
+    """Écrire l'export dans un fichier temporaire (en mémoire jusqu'à EXPORT_SPOOL_SIZE)"""
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    for chunk in iter_export(records, fmt):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
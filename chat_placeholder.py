@@ -0,0 +1,68 @@
+"""
+Message d'attente réutilisé comme conteneur de la réponse.
+
+Au lieu de supprimer le message « ⏳ Traitement en cours... » en
+reconstruisant `instance.objects` (copie de toute la liste et nouveau
+diff de tous les messages), on modifie ce message en place : seul ce
+modèle est mis à jour, quelle que soit la longueur de la conversation.
+"""
+
+from metrics import RENDER_SECONDS
+from tracing import span
+
+
+class Placeholder:
+    """Message temporaire affiché pendant un traitement, puis transformé en réponse"""
+
+    def __init__(self, instance, text="⏳ Traitement en cours...", user='💭 Système'):
+        self.instance = instance
+        self.text = text
+        # Le post_hook ne voit que la réponse définitive, pas le texte d'attente
+        with RENDER_SECONDS.timer(kind='placeholder'), span('render.placeholder'):
+            self.message = instance.send(text, user=user, respond=False, trigger_post_hook=False)
+
+    def update(self, text, user=None):
+        """Changer le texte d'attente (par exemple une position dans la file)"""
+        self.message.update({'object': text}, user=user)
+
+    def show_queue_position(self, position):
+        """Afficher la position dans la file d'admission (0 : texte d'attente initial)"""
+        self.update(queue_text(position) if position else self.text)
+
+    def resolve(self, text, user):
+        """Transformer le message d'attente en message définitif"""
+        with RENDER_SECONDS.timer(kind='reply'), span('render.reply'):
+            self.message.update({'object': text}, user=user)
+        if self.instance.post_hook is not None:
+            self.instance.post_hook(self.message, self.instance)
+        return self.message
+
+    def remove(self):
+        """Retirer le message d'attente, si aucune réponse ne doit le remplacer"""
+        self.instance.objects = [msg for msg in self.instance.objects if msg is not self.message]
+
+
+def queue_text(position):
+    return f"⏳ En file d'attente (position {position})..."
+
+
+def queue_notifier(instance):
+    """Position dans la file pour un callback sans message d'attente.
+
+    Le message n'est créé que si la requête attend, et retiré dès qu'elle
+    sort de la file.
+    """
+    placeholder = None
+
+    def notify(position):
+        nonlocal placeholder
+        if not position:
+            if placeholder is not None:
+                placeholder.remove()
+                placeholder = None
+        elif placeholder is None:
+            placeholder = Placeholder(instance, queue_text(position))
+        else:
+            placeholder.update(queue_text(position))
+
+    return notify
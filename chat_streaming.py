@@ -0,0 +1,109 @@
+"""
+Adaptateur de streaming pour les ChatMessage Panel.
+
+Plutôt que de pousser le texte cumulé à chaque token (O(n²) octets et un
+patch Bokeh par token), les fragments sont mis en tampon puis ajoutés au
+message par deltas, au plus une fois par intervalle ou dès que le tampon
+dépasse un seuil d'octets.
+"""
+
+import asyncio
+import os
+
+from metrics import RENDER_SECONDS
+from tracing import span
+
+# Configuration du regroupement des mises à jour
+STREAM_CONFIG = {
+    'interval': float(os.getenv('STREAM_FLUSH_INTERVAL', 0.05)),  # secondes (20 images/s)
+    'max_bytes': int(os.getenv('STREAM_FLUSH_BYTES', 2048))
+}
+
+
+async def coalesce(chunks, interval=STREAM_CONFIG['interval'], max_bytes=STREAM_CONFIG['max_bytes']):
+    """Regrouper les fragments d'un itérable asynchrone en deltas plus gros.
+
+    Le premier fragment est transmis immédiatement pour ne pas retarder le
+    premier affichage ; les suivants sont regroupés jusqu'à `interval`
+    secondes ou `max_bytes` octets, sans attendre le fragment suivant si le
+    producteur marque une pause.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    buffer = []
+    size = 0
+    deadline = None
+    first = True
+    pending = asyncio.ensure_future(iterator.__anext__())
+
+    try:
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                # Intervalle écoulé : vider le tampon sans attendre le producteur
+                yield ''.join(buffer)
+                buffer, size = [], 0
+                continue
+
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # Producteur en erreur : afficher d'abord les fragments déjà reçus
+                if buffer:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+                raise
+            pending = asyncio.ensure_future(iterator.__anext__())
+
+            if not chunk:
+                continue
+            if first:
+                first = False
+                yield chunk
+                continue
+
+            if not buffer:
+                deadline = loop.time() + interval
+            buffer.append(chunk)
+            size += len(chunk.encode('utf-8'))
+
+            if size >= max_bytes:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+
+        if buffer:
+            yield ''.join(buffer)
+    finally:
+        if not pending.done():
+            pending.cancel()
+
+
+class StreamInterrupted(Exception):
+    """Flux en erreur après l'affichage d'une partie de la réponse, conservée dans `message`"""
+
+    def __init__(self, message, error):
+        super().__init__(f"{type(error).__name__} - {error}")
+        self.message = message
+        self.error = error
+
+
+async def stream_to_message(instance, chunks, user, avatar=None, message=None, **coalesce_params):
+    """Ajouter les fragments de `chunks` à un seul ChatMessage, par deltas regroupés.
+
+    Retourne le message mis à jour, ou None si aucun fragment n'a été reçu.
+    Une erreur du flux après le premier fragment lève StreamInterrupted.
+    """
+    partial_message = message
+    try:
+        async for delta in coalesce(chunks, **coalesce_params):
+            with RENDER_SECONDS.timer(kind='stream'), span('render.stream'):
+                message = instance.stream(delta, user=user, avatar=avatar, message=message)
+    except Exception as e:
+        if message is not partial_message:
+            raise StreamInterrupted(message, e) from e
+        raise
+    return message
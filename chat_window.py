@@ -0,0 +1,184 @@
+"""
+Fenêtre glissante sur l'historique d'un ChatInterface.
+
+Le `Feed` de Panel ne rend déjà que les messages visibles (± `load_buffer`),
+mais tous les ChatMessage restent vivants dans la session. Ici, au-delà de
+`max_live` messages, les plus anciens sont archivés sous forme compacte et
+retirés du chat ; un bouton permet de les réafficher page par page, depuis
+la mémoire ou depuis le journal de conversation sur disque.
+"""
+
+import os
+import weakref
+from datetime import datetime
+
+import panel as pn
+
+from conversation import CONVERSATION_CONFIG
+
+# Configuration de la fenêtre d'historique
+WINDOW_CONFIG = {
+    # Messages rendus de part et d'autre de la zone visible (Feed de Panel)
+    'load_buffer': int(os.getenv('CHAT_LOAD_BUFFER', 20)),
+    # Nombre de ChatMessage gardés vivants dans la session
+    'max_live': int(os.getenv('CHAT_MAX_LIVE_MESSAGES', 200)),
+    # Nombre de messages archivés ou réaffichés à la fois
+    'page_size': int(os.getenv('CHAT_PAGE_SIZE', 50))
+}
+
+
+def conversation_key(session_id):
+    """Clé du journal de conversation pour le navigateur courant.
+
+    Utilisateur authentifié (`pn.state.user`), sinon cookie d'identité
+    configuré, sinon la session elle-même : la conversation n'est alors
+    pas reprise au rechargement, mais n'est jamais partagée.
+    """
+    user = pn.state.user
+    if user:
+        return f"user:{user}"
+    cookie = CONVERSATION_CONFIG['identity_cookie']
+    if cookie and pn.state.cookies.get(cookie):
+        return f"cookie:{pn.state.cookies[cookie]}"
+    return f"session:{session_id}"
+
+
+class WindowedHistory:
+    """Archive les messages les plus anciens d'un ChatInterface et les réaffiche à la demande.
+
+    L'élagage n'a lieu qu'une fois `max_live + page_size` messages atteints,
+    par blocs de `page_size` : son coût est amorti sur autant de messages.
+    Les messages réaffichés restent visibles jusqu'au prochain élagage.
+
+    Avec un `log` (ConversationLog), les messages enregistrés par `record`
+    sont persistés sur disque : l'archive n'est plus gardée en mémoire et
+    les pages plus anciennes sont relues depuis le journal.
+    """
+
+    def __init__(self, instance, max_live=WINDOW_CONFIG['max_live'], page_size=WINDOW_CONFIG['page_size'],
+                 log=None, conversation=None):
+        self.instance = instance
+        self.max_live = max_live
+        self.page_size = page_size
+        self.log = log
+        self.conversation = conversation
+        # Archive compacte en mémoire (sans journal), du plus ancien au plus récent :
+        # (user, object, avatar, timestamp)
+        self._archive = []
+        # Identifiants dans le journal des messages affichés, et borne de l'archive sur disque
+        self._log_ids = weakref.WeakKeyDictionary()
+        self._before_id = None
+        self._trimming = False
+        self.load_button = pn.widgets.Button(
+            name="⬆️ Messages précédents",
+            button_type='light',
+            visible=False,
+            sizing_mode='stretch_width'
+        )
+        self.load_button.on_click(self.load_older)
+        instance.param.watch(self._trim, 'objects')
+
+    @property
+    def archived(self):
+        """Nombre de messages archivés"""
+        if self.log is not None:
+            if self._before_id is None:
+                return 0
+            return self.log.count_before(self.conversation, self._before_id)
+        return len(self._archive)
+
+    def record(self, message, instance=None):
+        """Persister un message affiché (signature d'un post_hook de ChatInterface)"""
+        if self.log is None or message in self._log_ids:
+            return
+        timestamp = message.timestamp.timestamp() if message.timestamp else None
+        self._log_ids[message] = self.log.append(self.conversation, message.user, message.object, timestamp)
+
+    def restore(self):
+        """Réafficher la page la plus récente du journal ; retourne le nombre de messages relus"""
+        if self.log is None:
+            return 0
+        rows = self.log.page(self.conversation, limit=self.page_size)
+        if rows:
+            self._prepend_rows(rows)
+        return len(rows)
+
+    def _trim(self, event=None):
+        """Archiver les messages les plus anciens quand la fenêtre déborde"""
+        objects = self.instance.objects
+        if self._trimming or len(objects) < self.max_live + self.page_size:
+            return
+        cutoff = len(objects) - self.max_live
+        if self.log is not None:
+            # Déjà sur disque : il suffit de retenir la borne de l'archive
+            trimmed_ids = [self._log_ids[msg] for msg in objects[:cutoff] if msg in self._log_ids]
+            if trimmed_ids:
+                self._before_id = max(trimmed_ids) + 1
+        else:
+            self._archive.extend(
+                (msg.user, msg.object, msg.avatar, msg.timestamp) for msg in objects[:cutoff]
+            )
+        self._set_objects(objects[cutoff:])
+        self._update_button()
+
+    def load_older(self, event=None):
+        """Réafficher en tête du chat la page de messages archivés la plus récente"""
+        if self.log is not None:
+            if self._before_id is None:
+                return
+            rows = self.log.page(self.conversation, before_id=self._before_id, limit=self.page_size)
+            if rows:
+                self._prepend_rows(rows)
+            else:
+                self._before_id = None
+                self._update_button()
+            return
+
+        if not self._archive:
+            return
+        page = self._archive[-self.page_size:]
+        del self._archive[-self.page_size:]
+        restored = [self._build_message(user, obj, avatar, timestamp) for user, obj, avatar, timestamp in page]
+        self._set_objects(restored + list(self.instance.objects))
+        self._update_button()
+
+    def _prepend_rows(self, rows):
+        """Afficher en tête du chat des lignes du journal (id, user, content, timestamp)"""
+        restored = []
+        for log_id, user, content, timestamp in rows:
+            message = self._build_message(user, content, timestamp=datetime.fromtimestamp(timestamp))
+            self._log_ids[message] = log_id
+            restored.append(message)
+        self._before_id = rows[0][0]
+        self._set_objects(restored + list(self.instance.objects))
+        self._update_button()
+
+    def _build_message(self, user, obj, avatar=None, timestamp=None):
+        params = dict(self.instance.message_params)
+        if avatar:
+            params['avatar'] = avatar
+        if timestamp is not None:
+            params['timestamp'] = timestamp
+        return pn.chat.ChatMessage(obj, user=user, **params)
+
+    def _set_objects(self, objects):
+        self._trimming = True
+        try:
+            self.instance.objects = objects
+        finally:
+            self._trimming = False
+
+    def _update_button(self):
+        archived = self.archived
+        self.load_button.visible = bool(archived)
+        self.load_button.name = f"⬆️ Messages précédents ({archived})"
+
+    def iter_history(self):
+        """Parcourir tout l'historique sous forme de couples (user, object)"""
+        if self.log is not None:
+            yield from self.log.iter_messages(self.conversation)
+            return
+        for user, obj, _, _ in self._archive:
+            yield user, obj
+        for msg in self.instance.objects:
+            yield msg.user, msg.object
@@ -1,211 +1,316 @@
 import panel as pn
-import httpx
-from io import StringIO
-import json
+from panel.io import hold
 import urllib.parse
 import os
-import pika
-import threading
 import asyncio
 import re
+import time
+from functools import partial
 
-pn.extension()
+from admission import AdmissionRejected, admission
+from chat_export import EXPORT_FORMATS, export_file, export_filename
+from chat_placeholder import queue_notifier
+from codec import loads
+from chat_streaming import StreamInterrupted, stream_to_message
+from chat_window import WINDOW_CONFIG, WindowedHistory, conversation_key
+from conversation import ConversationStore, get_conversation_log
+from http_client import get_http_client
+from metrics import CANCELLED, ERRORS, FIRST_BYTE_SECONDS, RENDER_SECONDS, REQUESTS, RESPONSE_SECONDS, log_payload
+from rabbitmq_consumer import rabbitmq_router
+from response_cache import response_cache
+from single_flight import single_flight
+from tracing import current_trace_id, span, trace_headers, traced_callback
 
-# Configuration RabbitMQ
-RABBITMQ_CONFIG = {
-    'host': os.getenv('RABBITMQ_HOST', 'localhost'),
-    'port': int(os.getenv('RABBITMQ_PORT', 30645)),
-    'user': os.getenv('RABBITMQ_USER'),
-    'password': os.getenv('RABBITMQ_PASSWORD'),
-    'queue_name': os.getenv('QUEUE_NAME', 'queue_chatbot')
-}
+pn.extension()
 
 llm_endpoint: str = 'http://127.0.0.1:8001/v1/user_proxy/ask'
 model_id: str = 'gpt-4o-mini'
 user_id: str = 'vinh'
+# Mode streaming : lecture incrémentale de la réponse (SSE ou NDJSON)
+llm_streaming: bool = os.getenv('LLM_STREAMING', 'false').lower() in ('1', 'true', 'yes')
 
-def rabbitmq_listener():
-    # Importer pika à l'intérieur de la fonction pour éviter les problèmes de portée
-    import pika
-    
-    credentials = pika.PlainCredentials(RABBITMQ_CONFIG['user'], RABBITMQ_CONFIG['password'])
-    parameters = pika.ConnectionParameters(
-        host=RABBITMQ_CONFIG['host'], 
-        port=RABBITMQ_CONFIG['port'], 
-        credentials=credentials,
-        virtual_host='/',
-        # Ajouter des paramètres de timeout et de reconnexion
-        connection_attempts=3,  # Nombre de tentatives de connexion
-        socket_timeout=10,  # Timeout de socket en secondes
-        heartbeat=600  # Heartbeat plus long pour éviter les déconnexions
-    )
-    
-    def callback(ch, method, properties, body):
-        try:
-            message_str = body.decode('utf-8')
-            
-            try:
-                message_data = json.loads(message_str)
-            except json.JSONDecodeError:
-                chat_interface.send(message_str, user="Myboun")
-                return
-            
-            # Extraction du contenu avec une logique simple et directe
-            content = (
-                message_data.get('content') or 
-                message_data.get('result') or 
-                message_data.get('message') or 
-                str(message_data)
-            )
-            
-            # Envoyer le contenu
-            chat_interface.send(content, user="Myboun")
-        
-        except Exception as e:
-            # Gestion générique des exceptions
-            print(f"Erreur lors du traitement du message : {e}")
-            chat_interface.send(f"Erreur de traitement : {e}", user="Myboun")
-
-    connection = None
-    try:
-        # Utiliser une boucle pour gérer les reconnexions
-        while True:
+async def render_rabbitmq_messages(messages):
+    """Afficher en une seule mise à jour du document les messages RabbitMQ destinés à cette session"""
+    with RENDER_SECONDS.timer(kind='rabbitmq'), hold(session_doc):
+        for message_data in messages:
             try:
-                connection = pika.BlockingConnection(parameters)
-                channel = connection.channel()
-                
-                # Déclarer la file d'attente avec des paramètres explicites
-                channel.queue_declare(
-                    queue=RABBITMQ_CONFIG['queue_name'], 
-                    durable=True,  # Rendre la file d'attente durable
-                    exclusive=False,
-                    auto_delete=False
-                )
-                
-                channel.basic_consume(
-                    queue=RABBITMQ_CONFIG['queue_name'], 
-                    on_message_callback=callback, 
-                    auto_ack=True
-                )
-                
-                print(f"Started listening to RabbitMQ queue: {RABBITMQ_CONFIG['queue_name']}")
-                channel.start_consuming()
-            
-            except (pika.exceptions.AMQPConnectionError, 
-                    pika.exceptions.AMQPChannelError, 
-                    pika.exceptions.StreamLostError) as conn_error:
-                print(f"Connexion RabbitMQ perdue : {conn_error}. Tentative de reconnexion...")
-                
-                # Attendre avant de réessayer
-                import time
-                time.sleep(5)
+                # Extraction du contenu avec une logique simple et directe
+                content = extract_content(message_data)
                 
-                # Continuer la boucle pour une nouvelle tentative
-                continue
+                # Envoyer le contenu (le callback ignore de toute façon les messages de Myboun)
+                chat_interface.send(content, user="Myboun", respond=False)
             
             except Exception as e:
-                print(f"Erreur inattendue : {e}")
-                break
-    
-    finally:
-        # Fermer proprement la connexion si elle existe
-        if connection and not connection.is_closed:
-            connection.close()
+                # Gestion générique des exceptions
+                print(f"Erreur lors du traitement du message : {e}")
+                chat_interface.send(f"Erreur de traitement : {e}", user="Myboun", respond=False)
+
+def _session_key():
+    """Identifiant de la session Panel courante (ou de l'utilisateur hors serveur)"""
+    doc = pn.state.curdoc
+    if doc is not None and doc.session_context is not None:
+        return doc.session_context.id
+    return user_id
+
+session_key = _session_key()
+# Identité du navigateur (utilisateur authentifié, cookie ou session) : seau
+# d'admission et journal de conversation, jamais partagés entre utilisateurs
+client_key = conversation_key(session_key)
+session_doc = pn.state.curdoc
+
+# Un consommateur RabbitMQ partagé remet à cette session les messages qui la concernent :
+# adressés à sa session ou à son navigateur, identités envoyées avec chaque requête
+pn.state.onload(partial(rabbitmq_router.register, session_key, client_key, render_rabbitmq_messages))
+pn.state.on_session_destroyed(lambda session_context: rabbitmq_router.unregister(session_context.id))
+
+def extract_content(data):
+    """Extraire le texte d'une réponse JSON du backend avec une logique flexible"""
+    if not isinstance(data, dict):
+        return str(data)
+    return (
+        data.get('content') or 
+        data.get('result') or 
+        data.get('message') or 
+        str(data)
+    )
+
+def parse_stream_chunk(payload: str) -> str:
+    """Extraire le fragment de texte d'une ligne SSE/NDJSON"""
+    try:
+        data = loads(payload)
+    except ValueError:
+        # Ligne en texte brut
+        return payload
+    if isinstance(data, dict):
+        return data.get('delta') or data.get('content') or data.get('result') or ''
+    return data if isinstance(data, str) else ''
+
+async def stream_llm_response(client, url, outcome=None):
+    """Lire la réponse du backend au fil de l'eau et produire les fragments de texte.
+
+    Gère les flux SSE (`text/event-stream`) et NDJSON ; toute autre réponse
+    est lue en entier et traitée comme le JSON complet habituel. En fin de
+    flux, `outcome['success']` indique un statut 2xx.
+    """
+    headers = {'accept': 'text/event-stream, application/x-ndjson, application/json', **trace_headers()}
+    start = time.perf_counter()
+    REQUESTS.inc(transport='http')
+    async with client.stream('POST', url, data='', headers=headers) as response:
+        FIRST_BYTE_SECONDS.observe(time.perf_counter() - start, transport='http')
+        if response.is_error:
+            ERRORS.inc(stage='backend')
+        content_type = response.headers.get('content-type', '')
+        log_payload("Statut de la réponse (streaming)", f"{response.status_code}, type : {content_type}")
+
+        if 'text/event-stream' in content_type:
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                chunk = parse_stream_chunk(payload)
+                if chunk:
+                    yield chunk
+
+        elif 'ndjson' in content_type or 'jsonl' in content_type:
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = parse_stream_chunk(line)
+                if chunk:
+                    yield chunk
 
-# Démarrer le listener RabbitMQ dans un thread séparé
-rabbitmq_thread = threading.Thread(target=rabbitmq_listener, daemon=True)
-rabbitmq_thread.start()
+        else:
+            # Le backend ne streame pas : réponse JSON complète
+            await response.aread()
+            try:
+                yield extract_content(loads(response.content))
+            except ValueError:
+                yield response.text
+        if outcome is not None:
+            outcome['success'] = response.is_success
+    RESPONSE_SECONDS.observe(time.perf_counter() - start, transport='http')
 
+@traced_callback('chat.callback', app='rest')
 async def callback(contents: str, user: str, instance: pn.chat.ChatInterface):
     # Vérifier si le message provient de RabbitMQ
     if user == "Myboun":
         # Si le message vient de RabbitMQ, ne rien faire d'autre
         return
 
-    messages = instance.serialize()[1:]
+    # Prendre le dernier message comme requête, sans resérialiser tout l'historique
+    last_turn = conversation.last('user')
+    last_message = last_turn['content'] if last_turn else contents
     
-    # Prendre le dernier message comme requête
-    last_message = messages[-1]['content'] if messages else contents
+    # Réponse déjà en cache pour cette requête (si le cache est activé)
+    cached = response_cache.get(last_message, model_id, llm_endpoint)
+    if cached is not None:
+        yield cached
+        return
     
     # Construire les paramètres de requête de manière robuste
     params = {
         'query': last_message,
         'model_id': model_id,
-        'user_id': user_id
+        'user_id': user_id,
+        # Destinataires des messages RabbitMQ que le backend publiera pour cette requête
+        'session_id': session_key,
+        'client_id': client_key
     }
+    if llm_streaming:
+        params['stream'] = 'true'
+    trace_id = current_trace_id()
+    if trace_id:
+        params['trace_id'] = trace_id
     query_string = urllib.parse.urlencode(params)
     url = f"{llm_endpoint}?{query_string}"
     
-    print(f"Tentative de connexion à l'URL : {url}")  # Debug print
+    log_payload("Tentative de connexion à l'URL", url)
     
-    async with httpx.AsyncClient(timeout=30.0, verify=False) as client:  # Augmenter le timeout et désactiver la vérification SSL
+    client = get_http_client()  # Client partagé : connexions réutilisées entre les messages
+
+    # Une place d'admission par requête ; la position s'affiche si elle doit attendre
+    try:
+        await admission.acquire(client_key, on_position=queue_notifier(instance))
+    except AdmissionRejected as e:
+        yield f"⚠️ {str(e)}"
+        return
+
+    try:
+        if llm_streaming:
+            try:
+                # Les fragments sont ajoutés au même message au fil de l'eau
+                # Requêtes identiques en vol : un seul flux lu depuis le backend
+                key = single_flight.key(last_message, model_id, llm_endpoint)
+                outcome = {}
+                chunks = single_flight.stream(key, partial(stream_llm_response, client, url, outcome))
+                message = await stream_to_message(instance, chunks, user="Myboun")
+                if message is not None:
+                    # stream() ne déclenche pas le post_hook : enregistrer la réponse complète, ce message
+                    # précisément (un message RabbitMQ affiché entre-temps peut être le dernier du fil)
+                    if instance.post_hook is not None:
+                        instance.post_hook(message, instance)
+                    # Seul un flux complet avec un statut 2xx est mis en cache (celui qui a lu le flux partagé)
+                    if outcome.get('success'):
+                        response_cache.set(last_message, model_id, llm_endpoint, message.object)
+                else:
+                    # Flux terminé sans aucun fragment
+                    yield "Désolé, je n'ai pas de réponse à fournir."
+                return
+            except StreamInterrupted as e:
+                # Réponse déjà en partie affichée : pas de repli, qui la doublerait et interrogerait
+                # à nouveau le backend ; le message partiel est conservé avec l'erreur, sans cache
+                print(f"Flux interrompu : {str(e)}")
+                ERRORS.inc(stage='stream')
+                message = instance.stream(f"\n\n⚠️ Réponse interrompue : {str(e)}", user="Myboun", message=e.message)
+                if instance.post_hook is not None:
+                    instance.post_hook(message, instance)
+                return
+            except Exception as e:
+                print(f"Erreur en mode streaming : {type(e).__name__} - {str(e)}. Repli sur la requête JSON complète")
+                ERRORS.inc(stage='stream')
+
         try:
-            # Utiliser post avec un corps de requête vide
-            response = await client.post(url, data='', headers={'accept': 'application/json'})
-            
+            # Utiliser post avec un corps de requête vide ; requêtes identiques en vol regroupées
+            REQUESTS.inc(transport='http')
+            with RESPONSE_SECONDS.timer(transport='http'), span('backend.http'):
+                response = await single_flight.do(
+                    single_flight.key(last_message, model_id, llm_endpoint),
+                    partial(client.post, url, data='', headers={'accept': 'application/json', **trace_headers()})
+                )
+            if response.is_error:
+                ERRORS.inc(stage='backend')
+        
             print(f"Statut de la réponse : {response.status_code}")  # Debug print
-            print(f"En-têtes de la réponse : {response.headers}")  # Debug print
-            print(f"Contenu brut de la réponse : {response.text}")  # Debug print
-            
+            # En-têtes et contenus : journalisés par échantillonnage seulement (PAYLOAD_LOG_RATE)
+            log_payload("En-têtes de la réponse", response.headers)
+            log_payload("Contenu brut de la réponse", response.text)
+        
             # Tenter de décoder le JSON
             try:
-                data = response.json()
-                print(f"Données JSON reçues : {data}")  # Debug print
-                
+                data = loads(response.content)
+            
                 # Extraction du contenu avec une logique flexible
-                content = (
-                    data.get('content') or 
-                    data.get('result') or 
-                    data.get('message') or 
-                    str(data)
-                )
-                
+                content = extract_content(data)
+                if response.is_success:
+                    response_cache.set(last_message, model_id, llm_endpoint, content)
                 yield content
-            
-            except json.JSONDecodeError as json_err:
+        
+            except ValueError as json_err:
                 # Si le JSON ne peut pas être décodé, utiliser le texte brut
-                error_msg = f"Erreur de décodage JSON : {json_err}. Contenu brut : {response.text}"
-                print(error_msg)
+                print(f"Erreur de décodage JSON : {json_err}")
+                ERRORS.inc(stage='decode')
                 yield response.text
-        
+    
         except Exception as e:
             # Capture de toutes les exceptions possibles
             error_msg = f"Erreur de connexion complète : {type(e).__name__} - {str(e)}"
             print(error_msg)
-            
+            ERRORS.inc(stage='connect')
+        
             # Tenter une dernière approche : utiliser l'URL originale sans modification
             try:
                 # Réessayer avec l'URL originale sans paramètres encodés
                 fallback_url = f"{llm_endpoint}?query={urllib.parse.quote(last_message)}&model_id={model_id}&user_id={user_id}"
-                print(f"Tentative de connexion de secours : {fallback_url}")
-                
+                fallback_url += f"&session_id={urllib.parse.quote(session_key)}&client_id={urllib.parse.quote(client_key)}"
+                log_payload("Tentative de connexion de secours", fallback_url)
+            
                 fallback_response = await client.post(fallback_url, data='', headers={'accept': 'application/json'})
                 print(f"Statut de la réponse de secours : {fallback_response.status_code}")
-                
-                yield fallback_response.text
             
+                yield fallback_response.text
+        
             except Exception as fallback_err:
                 final_error_msg = f"Échec de la connexion de secours : {type(fallback_err).__name__} - {str(fallback_err)}"
                 print(final_error_msg)
+                ERRORS.inc(stage='connect')
                 yield final_error_msg
+    except asyncio.CancelledError:
+        # Arrêt, vidage ou fermeture de l'onglet : la requête HTTP en cours est interrompue
+        CANCELLED.inc(transport='http')
+        raise
+    finally:
+        admission.release()
+
+export_format = pn.widgets.Select(options=list(EXPORT_FORMATS), value='jsonl', width=100)
 
 def download_history():
-   buf = StringIO()
-   json.dump(chat_interface.serialize(), buf)
-   buf.seek(0)
-   return buf
+   # Export écrit message par message, sans copie intégrale de l'historique en mémoire
+   return export_file(history.iter_history(), export_format.value)
 
 file_download = pn.widgets.FileDownload(
-   callback=download_history, filename="history.json"
+   callback=download_history, filename=export_filename("history", export_format.value)
+)
+export_format.param.watch(
+   lambda event: setattr(file_download, 'filename', export_filename("history", event.new)), 'value'
 )
-header = pn.Row(pn.HSpacer(), file_download)
+header = pn.Row(pn.HSpacer(), export_format, file_download)
 
 chat_interface = pn.chat.ChatInterface(
     callback=callback, 
     callback_user="Myboun",
-    header=header
+    header=header,
+    load_buffer=WINDOW_CONFIG['load_buffer']
     )
-chat_interface.send(
-    "Bonjour", user="Myboun", respond=False
-)
-chat_interface.servable()
\ No newline at end of file
+
+# Onglet fermé : annuler le callback en cours, ce qui interrompt la requête HTTP
+pn.state.on_session_destroyed(lambda session_context: chat_interface.stop())
+
+# Historique persistant (si activé) : seule la dernière page est relue au chargement
+history = WindowedHistory(chat_interface, log=get_conversation_log(), conversation=client_key)
+if not history.restore():
+    chat_interface.send(
+        "Bonjour", user="Myboun", respond=False
+    )
+
+# Historique incrémental, alimenté après le message d'accueil
+conversation = ConversationStore(assistant_users=["Myboun"])
+
+def on_message(message, instance):
+    """post_hook : alimenter le contexte en mémoire et le journal sur disque"""
+    conversation.on_message(message, instance)
+    history.record(message, instance)
+
+chat_interface.post_hook = on_message
+pn.Column(history.load_button, chat_interface).servable()
\ No newline at end of file
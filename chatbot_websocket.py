@@ -1,19 +1,17 @@
+import asyncio
+
 import param
 import panel as pn
-import asyncio
-import json
-import websockets
-import os
-import threading
-import urllib.parse
-from io import StringIO
-
-# Configuration WebSocket
-WEBSOCKET_CONFIG = {
-    'host': os.getenv('WEBSOCKET_HOST', 'localhost'),  
-    'port': int(os.getenv('WEBSOCKET_PORT', 8001)),       
-    'path': '/v1/ws'
-}
+
+from chat_export import EXPORT_FORMATS, export_file, export_filename
+from admission import AdmissionRejected, admission
+from chat_placeholder import Placeholder, queue_notifier
+from chat_streaming import StreamInterrupted, stream_to_message
+from chat_window import WINDOW_CONFIG, WindowedHistory, conversation_key
+from conversation import get_conversation_log
+from metrics import ERRORS, log_payload
+from tracing import traced_callback
+from websocket_client import DELTA_FRAME_TYPE, WEBSOCKET_CONFIG, websocket_pool
 
 model_id: str = 'gpt-4o-mini'
 user_id: str = 'vinh'
@@ -108,159 +106,30 @@ def update_connection_status(is_connected: bool):
     """Met à jour le statut de connexion"""
     connection_status.value = is_connected
 
-class WebSocketClient:
-    def __init__(self, user_id, host='localhost', port=8001, path='/v1/ws'):
-        self.user_id = user_id
-        self.host = host
-        self.port = port
-        self.path = path
-        self.uri = f"ws://{host}:{port}{path}?user_id={urllib.parse.quote(user_id)}"
-        self.websocket = None
-        self.connected = False
-        self._connect_task = None
-        self._session_id = None
-        print(f"WebSocket URI initialisée : {self.uri}")
-
-    async def connect(self):
-        if self.connected:
-            return True
-            
-        if self._connect_task and not self._connect_task.done():
-            return await self._connect_task
-        
-        self._connect_task = asyncio.create_task(self._connect())
-        return await self._connect_task
-
-    async def _connect(self):
-        try:
-            print(f"Tentative de connexion à : {self.uri}")
-            self.websocket = await websockets.connect(
-                self.uri,
-                ping_interval=20,
-                ping_timeout=20
-            )
-            self.connected = True
-            update_connection_status(True)
-            print("✅ Connexion WebSocket établie")
-            
-            # Recevoir et traiter le message de connexion
-            connection_response = await self.websocket.recv()
-            connection_data = json.loads(connection_response)
-            
-            if connection_data.get('status') == 'success':
-                self._session_id = connection_data.get('data', {}).get('session_id')
-                print(f"📡 Session ID obtenu : {self._session_id}")
-            
-            # Lancer une tâche pour surveiller la connexion
-            asyncio.create_task(self._monitor_connection())
-            
-            return True
-        except Exception as e:
-            print(f"❌ Erreur de connexion WebSocket : {type(e).__name__} - {str(e)}")
-            self.connected = False
-            update_connection_status(False)
-            return False
-
-    async def _monitor_connection(self):
-        """Surveiller en continu l'état de la connexion"""
-        try:
-            while self.connected:
-                try:
-                    # Envoyer un ping
-                    await self.websocket.ping()
-                    await asyncio.sleep(15)  # Vérifier toutes les 15 secondes
-                except websockets.exceptions.ConnectionClosed:
-                    print("❌ Connexion WebSocket fermée de manière inattendue")
-                    self.connected = False
-                    update_connection_status(False)
-                    await self.connect()
-                    break
-        except Exception as e:
-            print(f"❌ Erreur lors de la surveillance de la connexion : {str(e)}")
-
-    async def send_message(self, message: str):
-        if not self.connected:
-            success = await self.connect()
-            if not success:
-                return None
-
-        try:
-            # Préparer le message avec les informations de session
-            message_payload = {
-                "query": message,
-                "user_id": self.user_id,
-                "model_id": model_id
-            }
-            
-            # Ajouter l'ID de session si disponible
-            if self._session_id:
-                message_payload["session_id"] = self._session_id
-            
-            await self.websocket.send(json.dumps(message_payload))
-            
-            # Boucle pour gérer les messages de ping
-            while True:
-                response = await self.websocket.recv()
-                response_data = json.loads(response)
-                
-                # Ignorer les messages de ping
-                if isinstance(response_data, dict) and response_data.get('type') == 'ping':
-                    print("🏓 Message ping reçu, en attente d'une réponse valide")
-                    continue
-                
-                # Retourner la première réponse non-ping
-                return response_data
-        
-        except websockets.exceptions.ConnectionClosed:
-            print("❌ Connexion perdue, tentative de reconnexion...")
-            self.connected = False
-            update_connection_status(False)
-            await self.connect()
-            return await self.send_message(message)
-        except Exception as e:
-            print(f"❌ Erreur lors de l'envoi du message : {type(e).__name__} - {str(e)}")
-            self.connected = False
-            update_connection_status(False)
-            return None
-
-    async def close(self):
-        if self.websocket:
-            await self.websocket.close()
-            self.connected = False
-            update_connection_status(False)
-            self._session_id = None
-
+@traced_callback('chat.callback', app='websocket')
 async def callback(contents: str, user: str, instance: pn.chat.ChatInterface):
     """Callback pour gérer les messages du chat"""
+    placeholder = None
     try:
-        # Journalisation détaillée
-        print(f"📨 Message reçu - Contenu: {contents}, Utilisateur: {user}")
+        # Contenu journalisé par échantillonnage seulement (PAYLOAD_LOG_RATE)
+        log_payload(f"📨 Message reçu de {user}", contents)
 
         # Ne pas traiter les messages système ou assistant
         if user in ['Système', 'Assistant', '🤖 Assistant']:
             return
 
-        # Indiquer que le message est en cours de traitement
-        loading_message = instance.send(
-            "⏳ Traitement en cours...", 
-            user='💭 Système',
-            respond=False
-        )
-
-        # Envoyer le message et attendre la réponse
-        response = await websocket_client.send_message(contents)
-        print(f"🔬 Réponse reçue : {response}")  # Debug détaillé
+        # Indiquer que le message est en cours de traitement ;
+        # ce message sera ensuite transformé en réponse, sans reconstruire instance.objects
+        placeholder = Placeholder(instance)
 
-        # Supprimer le message de chargement
-        instance.objects = [msg for msg in instance.objects if msg != loading_message]
+        # Envoyer le message et attendre la réponse, une fois admis (position affichée en attendant)
+        async with admission.slot(client_key, on_position=placeholder.show_queue_position):
+            response = await get_websocket_client().send_message(contents)
+        log_payload("🔬 Réponse reçue", response)
         
         # Vérification de la réponse
         if not response or not isinstance(response, dict):
-            instance.send(
-                "Désolé, aucune réponse valide n'a été reçue.", 
-                user='⚠️ Système', 
-                respond=False
-            )
+            placeholder.resolve("Désolé, aucune réponse valide n'a été reçue.", user='⚠️ Système')
             return
 
         # Gestion des différents types de réponses
@@ -273,79 +142,184 @@ async def callback(contents: str, user: str, instance: pn.chat.ChatInterface):
             
             if content:
                 display_name = "Assistant" if agent == "Agent" else agent
-                instance.send(
-                    content, 
-                    user=f"🤖 {display_name}", 
-                    respond=False
-                )
+                placeholder.resolve(content, user=f"🤖 {display_name}")
             else:
-                instance.send(
-                    "Désolé, je n'ai pas de réponse à fournir.", 
-                    user='🤖 Assistant', 
-                    respond=False
-                )
+                placeholder.resolve("Désolé, je n'ai pas de réponse à fournir.", user='🤖 Assistant')
         else:
             # Gestion des erreurs
             error_msg = response.get('message', 'Erreur inconnue')
-            instance.send(
-                f"❌ Erreur : {error_msg}", 
-                user='⚠️ Système', 
-                respond=False
-            )
+            placeholder.resolve(f"❌ Erreur : {error_msg}", user='⚠️ Système')
     
+    except AdmissionRejected as e:
+        # Surcharge : refus immédiat plutôt qu'une attente sans fin
+        placeholder.resolve(f"⚠️ {str(e)}", user='⚠️ Système')
+
+    except asyncio.CancelledError:
+        # Arrêt demandé (bouton, vidage, fermeture de l'onglet) : retirer le message d'attente
+        if placeholder is not None:
+            placeholder.remove()
+        raise
+
     except Exception as e:
         # Gestion des exceptions globales
         print(f"❌ Erreur critique dans le callback : {type(e).__name__} - {str(e)}")
+        ERRORS.inc(stage='callback')
         import traceback
         traceback.print_exc()  # Afficher la trace complète
-        instance.send(
-            f"❌ Erreur critique de communication : {str(e)}", 
-            user='⚠️ Système', 
-            respond=False
-        )
+        error_text = f"❌ Erreur critique de communication : {str(e)}"
+        if placeholder is not None:
+            placeholder.resolve(error_text, user='⚠️ Système')
+        else:
+            instance.send(error_text, user='⚠️ Système', respond=False)
 
-# Initialisation du client WebSocket
-websocket_client = WebSocketClient(
-    user_id=user_id, 
-    host=WEBSOCKET_CONFIG['host'], 
-    port=WEBSOCKET_CONFIG['port'],
-    path=WEBSOCKET_CONFIG['path']
-)
+@traced_callback('chat.callback', app='websocket', stream=True)
+async def stream_callback(contents: str, user: str, instance: pn.chat.ChatInterface):
+    """Callback en mode streaming : la réponse s'affiche fragment par fragment"""
+    log_payload(f"📨 Message reçu (streaming) de {user}", contents)
+
+    # Ne pas traiter les messages système ou assistant
+    if user in ['Système', 'Assistant', '🤖 Assistant']:
+        return
 
-# Initialisation de l'interface de chat
+    reply = {'display_name': 'Assistant', 'final': None, 'error': None}
+
+    async def deltas():
+        """Extraire les fragments de texte des trames du backend"""
+        # Position dans la file affichée seulement si la requête doit attendre son admission
+        async with admission.slot(client_key, on_position=queue_notifier(instance)):
+            async for frame in get_websocket_client().stream_message(contents):
+                if not isinstance(frame, dict):
+                    continue
+
+                if frame.get('status') == 'error':
+                    reply['error'] = frame.get('message', 'Erreur inconnue')
+                    return
+
+                data = frame.get('data') or {}
+                agent = data.get('agent')
+                if agent:
+                    reply['display_name'] = "Assistant" if agent == "Agent" else agent
+
+                if frame.get('type') == DELTA_FRAME_TYPE:
+                    yield data.get('delta', '')
+                elif data.get('response'):
+                    # Trame finale complète : elle fait foi
+                    reply['final'] = data['response']
+
+    message = None
+    try:
+        # Les deltas sont regroupés puis ajoutés au même ChatMessage
+        message = await stream_to_message(instance, deltas(), user="🤖 Assistant")
+    except AdmissionRejected as e:
+        reply['error'] = str(e)
+    except StreamInterrupted as e:
+        # Début de réponse déjà affiché : il est conservé, l'erreur est signalée à la suite
+        message = e.message
+        ERRORS.inc(stage='callback')
+        reply['error'] = f"Erreur critique de communication : {str(e)}"
+    except Exception as e:
+        print(f"❌ Erreur critique dans le callback streaming : {type(e).__name__} - {str(e)}")
+        ERRORS.inc(stage='callback')
+        reply['error'] = f"Erreur critique de communication : {str(e)}"
+
+    display_user = f"🤖 {reply['display_name']}"
+    if reply['final'] and (message is None or message.object != reply['final']):
+        message = instance.stream(reply['final'], user=display_user, message=message, replace=True)
+    elif message is not None:
+        message.user = display_user
+
+    # stream() ne déclenche pas le post_hook : enregistrer la réponse complète
+    if message is not None and instance.post_hook is not None:
+        instance.post_hook(message, instance)
+
+    if reply['error']:
+        instance.send(f"❌ Erreur : {reply['error']}", user='⚠️ Système', respond=False)
+    elif message is None:
+        instance.send("Désolé, je n'ai pas de réponse à fournir.", user='🤖 Assistant', respond=False)
+
+# Client WebSocket propre à cette session navigateur
+def _session_key():
+    """Identifiant de la session Panel courante (ou de l'utilisateur hors serveur)"""
+    doc = pn.state.curdoc
+    if doc is not None and doc.session_context is not None:
+        return doc.session_context.id
+    return user_id
+
+session_key = _session_key()
+# Identité du navigateur (utilisateur authentifié, cookie ou session) : seau
+# d'admission et journal de conversation, jamais partagés entre utilisateurs
+client_key = conversation_key(session_key)
+
+def get_websocket_client():
+    """Récupère le client WebSocket de la session depuis le pool partagé"""
+    return websocket_pool.acquire(
+        session_key,
+        user_id=user_id,
+        model_id=model_id,
+        on_status_change=update_connection_status
+    )
+
+# Fermer le socket de la session à la fermeture de l'onglet
+pn.state.on_session_destroyed(lambda session_context: websocket_pool.release(session_context.id))
+
+# Initialisation de l'interface de chat ; le bouton d'arrêt (show_stop) annule le callback,
+# ce qui envoie au backend une trame d'annulation pour la requête en cours
 chat_interface = pn.chat.ChatInterface(
-    callback=callback,
+    callback=stream_callback if WEBSOCKET_CONFIG['streaming'] else callback,
     callback_user="👤 Utilisateur",
     show_rerun=False,
     show_undo=False,
     show_clear=True,
+    show_stop=True,
     sizing_mode='stretch_width',
-    min_height=600
+    min_height=600,
+    load_buffer=WINDOW_CONFIG['load_buffer']
 )
 
-# Message d'accueil
-chat_interface.send(
-    "👋 Bonjour ! Je suis votre assistant. Comment puis-je vous aider aujourd'hui ?",
-    user="🤖 Assistant",
-    respond=False
-)
+# Onglet fermé : annuler le callback en cours plutôt que laisser le backend générer pour personne
+pn.state.on_session_destroyed(lambda session_context: chat_interface.stop())
+
+# Seuls les messages récents restent vivants ; les plus anciens sont archivés,
+# sur disque si le journal de conversation est activé
+history = WindowedHistory(chat_interface, log=get_conversation_log(), conversation=client_key)
+
+# Reprendre la dernière page de la conversation enregistrée, sinon message d'accueil
+if not history.restore():
+    chat_interface.send(
+        "👋 Bonjour ! Je suis votre assistant. Comment puis-je vous aider aujourd'hui ?",
+        user="🤖 Assistant",
+        respond=False
+    )
+
+# Persister chaque nouveau message une fois affiché
+chat_interface.post_hook = history.record
 
 # Bouton de téléchargement
+export_format = pn.widgets.Select(
+    name='📄 Format',
+    options=list(EXPORT_FORMATS),
+    value='txt',
+    width=100
+)
+
 def download_history():
-    """Télécharge l'historique de la conversation"""
-    buffer = StringIO()
-    for msg in chat_interface.objects:
-        buffer.write(f"{msg.user}: {msg.object}\n")
-    return buffer.getvalue()
+    """Télécharge l'historique de la conversation, écrit message par message"""
+    return export_file(history.iter_history(), export_format.value)
 
 download_button = pn.widgets.FileDownload(
     callback=download_history,
-    filename='chat_history.txt',
+    filename=export_filename('chat_history', export_format.value),
     label="📥 Télécharger l'historique",
     button_type='primary',
     width=200
 )
 
+def on_export_format(event):
+    """Adapte le nom du fichier au format choisi"""
+    download_button.filename = export_filename('chat_history', event.new)
+
+export_format.param.watch(on_export_format, 'value')
+
 # Switch d'agent
 agent_options = ['user_proxy', 'orchestrator']
 agent_switch = pn.widgets.Select(
@@ -359,7 +333,7 @@ async def on_agent_switch(event):
     """Gère le changement d'agent"""
     new_agent = event.new
     try:
-        switch_result = await websocket_client.send_message(f"switch_agent {new_agent}")
+        switch_result = await get_websocket_client().send_message(f"switch_agent {new_agent}")
         
         if switch_result and switch_result.get('status') == 'success':
             chat_interface.send(f"✅ Passage à l'agent {new_agent}", user="🔄 Système", respond=False)
@@ -379,6 +353,7 @@ header = pn.Row(
     pn.Spacer(width=20),
     agent_switch,
     pn.Spacer(width=20),
+    export_format,
     download_button,
     sizing_mode='stretch_width'
 )
@@ -387,7 +362,7 @@ header = pn.Row(
 template = pn.template.FastListTemplate(
     title='Chat Phidata',
     header=header,
-    main=[chat_interface],
+    main=[history.load_button, chat_interface],
     accent_base_color="#88d8b0",
     header_background="#88d8b0",
 )
@@ -0,0 +1,171 @@
+"""
+Encodage des messages : JSON rapide et codecs des trames WebSocket.
+
+`dumps`/`loads` utilisent orjson ou msgspec s'ils sont installés, la
+bibliothèque standard sinon ; toute erreur de décodage lève ValueError.
+
+Le client WebSocket propose ses codecs par ordre de préférence (en-tête
+Sec-WebSocket-Protocol) ; le backend en retient un. Sans réponse du
+backend, les trames restent en JSON texte. MessagePack (trames binaires)
+est utilisé s'il est installé.
+"""
+
+import json
+import os
+from typing import TypedDict
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# Configuration des trames WebSocket
+CODEC_CONFIG = {
+    # Codecs proposés au backend, par ordre de préférence
+    'codecs': [name.strip() for name in os.getenv('WEBSOCKET_CODECS', 'msgpack,json').split(',') if name.strip()],
+    # Compression permessage-deflate : 'deflate' ou 'none'
+    'compression': os.getenv('WEBSOCKET_COMPRESSION', 'deflate').lower()
+}
+
+
+# Bibliothèque JSON la plus rapide disponible
+if orjson is not None:
+    JSON_BACKEND = 'orjson'
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode('utf-8')
+
+    # orjson.JSONDecodeError hérite de ValueError
+    loads = orjson.loads
+
+elif msgspec is not None:
+    JSON_BACKEND = 'msgspec'
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    def dumps(obj) -> str:
+        return _encoder.encode(obj).decode('utf-8')
+
+    def loads(data):
+        try:
+            return _decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+else:
+    JSON_BACKEND = 'json'
+
+    def dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    loads = json.loads
+
+
+class EnvelopeData(TypedDict, total=False):
+    response: object
+    agent: str
+    delta: str
+    session_id: str
+
+
+class Envelope(TypedDict, total=False):
+    """Trame du backend : {'status', 'type', 'request_id', 'message', 'data'}"""
+    status: str
+    type: str
+    request_id: str
+    message: object
+    data: EnvelopeData
+
+
+# Champs dont le type est vérifié : ceux que le client compare, indexe ou concatène
+_ENVELOPE_TYPES = {'status': str, 'type': str, 'request_id': str, 'data': dict}
+_DATA_TYPES = {'agent': str, 'delta': str, 'session_id': str}
+
+
+def _check_types(obj, types, where):
+    for key, expected in types.items():
+        value = obj.get(key)
+        if value is not None and not isinstance(value, expected):
+            raise ValueError(f"Champ {where}{key} invalide : {type(value).__name__}")
+
+
+def validate_envelope(obj) -> Envelope:
+    """Vérifier la forme d'une trame décodée ; ValueError si elle est malformée"""
+    if not isinstance(obj, dict):
+        raise ValueError(f"Trame inattendue : {type(obj).__name__}")
+    _check_types(obj, _ENVELOPE_TYPES, '')
+    data = obj.get('data')
+    if data:
+        _check_types(data, _DATA_TYPES, 'data.')
+    return obj
+
+
+class JsonCodec:
+    """JSON en trames texte"""
+
+    name = 'json'
+    subprotocol = 'chatbot.json'
+
+    def encode(self, obj) -> str:
+        return dumps(obj)
+
+    def decode(self, frame):
+        """Décoder une trame ; ValueError si elle est invalide"""
+        return loads(frame)
+
+
+class MsgpackCodec:
+    """MessagePack en trames binaires"""
+
+    name = 'msgpack'
+    subprotocol = 'chatbot.msgpack'
+
+    def encode(self, obj) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, frame):
+        """Décoder une trame ; ValueError si elle est invalide"""
+        if isinstance(frame, str):
+            # Trame texte (message d'erreur du serveur, par exemple) : JSON
+            return JSON_CODEC.decode(frame)
+        try:
+            return msgpack.unpackb(frame, raw=False)
+        except Exception as e:
+            raise ValueError(f"Trame MessagePack invalide : {e}") from e
+
+
+JSON_CODEC = JsonCodec()
+
+# Codecs disponibles dans cet environnement
+CODECS = {JSON_CODEC.name: JSON_CODEC}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def offered_subprotocols(names=None):
+    """Sous-protocoles proposés au backend, dans l'ordre de préférence"""
+    names = CODEC_CONFIG['codecs'] if names is None else names
+    return [CODECS[name].subprotocol for name in names if name in CODECS]
+
+
+def codec_for(subprotocol):
+    """Codec retenu par le backend, JSON par défaut"""
+    for codec in CODECS.values():
+        if codec.subprotocol == subprotocol:
+            return codec
+    return JSON_CODEC
+
+
+def compression():
+    """Argument `compression` de websockets.connect"""
+    return None if CODEC_CONFIG['compression'] in ('', 'none', 'off', 'false') else 'deflate'
@@ -0,0 +1,164 @@
+"""
+Historique incrémental d'une conversation.
+
+Chaque message est ajouté une seule fois, sous forme compacte, au moment où
+il est affiché : le callback accède au dernier tour en O(1) et à une
+fenêtre de contexte bornée, sans resérialiser tout le ChatInterface.
+
+`ConversationLog` persiste en option ces messages dans un journal SQLite
+append-only, lu ensuite page par page.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+# Configuration de l'historique
+CONVERSATION_CONFIG = {
+    'context_window': int(os.getenv('CONVERSATION_CONTEXT_WINDOW', 20)),
+    'max_records': int(os.getenv('CONVERSATION_MAX_RECORDS', 1000)),
+    # Journal SQLite des conversations ; vide pour désactiver la persistance
+    'log_path': os.getenv('CONVERSATION_LOG_PATH', ''),
+    # Cookie identifiant le navigateur (posé par l'application hôte ou un proxy) ; vide : aucun
+    'identity_cookie': os.getenv('CONVERSATION_IDENTITY_COOKIE', '')
+}
+
+
+class ConversationStore:
+    """Historique compact (rôle, contenu) alimenté message par message.
+
+    `on_message` a la signature d'un `post_hook` de ChatInterface et peut
+    lui être directement affecté.
+    """
+
+    def __init__(self, assistant_users=(), max_records=CONVERSATION_CONFIG['max_records'],
+                 context_window=CONVERSATION_CONFIG['context_window']):
+        self.assistant_users = {user.lower() for user in assistant_users}
+        self.context_window = context_window
+        self._records = deque(maxlen=max_records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def append(self, role: str, content):
+        """Ajouter un message à l'historique"""
+        self._records.append((role, content if isinstance(content, str) else str(content)))
+
+    def on_message(self, message, instance):
+        """Enregistrer un ChatMessage affiché (post_hook de ChatInterface)"""
+        is_assistant = message.user.lower() in self.assistant_users or message.user == instance.callback_user
+        self.append('assistant' if is_assistant else 'user', message.object)
+
+    def last(self, role=None):
+        """Dernier message (éventuellement du rôle donné), ou None"""
+        if role is None:
+            return self._as_dict(self._records[-1]) if self._records else None
+        for record in reversed(self._records):
+            if record[0] == role:
+                return self._as_dict(record)
+        return None
+
+    def context(self, size=None):
+        """Les `size` derniers messages au format {'role', 'content'}"""
+        size = self.context_window if size is None else size
+        recent = list(islice(reversed(self._records), size))
+        return [self._as_dict(record) for record in reversed(recent)]
+
+    @staticmethod
+    def _as_dict(record):
+        return {'role': record[0], 'content': record[1]}
+
+
+class ConversationLog:
+    """Journal SQLite append-only des messages, indexé par conversation.
+
+    Une conversation est identifiée par une clé libre (user_id, ou
+    user_id/session) : elle survit ainsi au rechargement de la page. La
+    lecture se fait par pages, de la plus récente vers la plus ancienne.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation TEXT NOT NULL,
+                user TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation, id)"
+        )
+
+    def append(self, conversation, user, content, timestamp=None) -> int:
+        """Ajouter un message et retourner son identifiant"""
+        if not isinstance(content, str):
+            content = str(content)
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO messages (conversation, user, content, timestamp) VALUES (?, ?, ?, ?)",
+                (conversation, user, content, time.time() if timestamp is None else timestamp)
+            )
+        return cursor.lastrowid
+
+    def page(self, conversation, before_id=None, limit=50):
+        """Les `limit` messages précédant `before_id` (ou les plus récents), du plus ancien au plus récent"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, user, content, timestamp FROM messages "
+                "WHERE conversation = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (conversation, before_id if before_id is not None else 2 ** 63 - 1, limit)
+            ).fetchall()
+        rows.reverse()
+        return rows
+
+    def count_before(self, conversation, before_id) -> int:
+        """Nombre de messages antérieurs à `before_id`"""
+        with self._lock:
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM messages WHERE conversation = ? AND id < ?",
+                (conversation, before_id)
+            ).fetchone()
+        return count
+
+    def iter_messages(self, conversation, batch_size=500):
+        """Parcourir toute la conversation par lots, sous forme de couples (user, contenu)"""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT id, user, content FROM messages "
+                    "WHERE conversation = ? AND id > ? ORDER BY id LIMIT ?",
+                    (conversation, last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for _, user, content in rows:
+                yield user, content
+            last_id = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_conversation_log = None
+
+
+def get_conversation_log():
+    """Journal partagé par toutes les sessions, ou None si la persistance est désactivée"""
+    global _conversation_log
+    if _conversation_log is None and CONVERSATION_CONFIG['log_path']:
+        _conversation_log = ConversationLog(CONVERSATION_CONFIG['log_path'])
+    return _conversation_log
@@ -0,0 +1,91 @@
+"""
+Client HTTP partagé vers le backend REST.
+
+Un seul httpx.AsyncClient est créé pour tout le serveur Panel : les
+connexions TCP/TLS sont gardées ouvertes et réutilisées d'un message à
+l'autre au lieu d'être rouvertes à chaque requête.
+"""
+
+import asyncio
+import atexit
+import importlib.util
+import os
+
+import httpx
+
+# Configuration du client HTTP
+HTTP_CONFIG = {
+    'timeout': float(os.getenv('HTTP_TIMEOUT', 30.0)),
+    'verify': os.getenv('HTTP_VERIFY', 'false').lower() in ('1', 'true', 'yes'),
+    'http2': os.getenv('HTTP_HTTP2', 'false').lower() in ('1', 'true', 'yes'),
+    'max_connections': int(os.getenv('HTTP_MAX_CONNECTIONS', 100)),
+    'max_keepalive_connections': int(os.getenv('HTTP_MAX_KEEPALIVE', 20)),
+    'keepalive_expiry': float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30.0))  # secondes
+}
+
+_client = None
+_client_loop = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 nécessite le paquet optionnel h2 (pip install 'httpx[http2]')"""
+    return importlib.util.find_spec('h2') is not None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Retourner le client partagé, créé à la première utilisation sur la boucle courante"""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is not None and not _client.is_closed and _client_loop is loop:
+        return _client
+
+    http2 = HTTP_CONFIG['http2']
+    if http2 and not _http2_available():
+        print("⚠️ HTTP/2 demandé mais le paquet h2 est absent, repli sur HTTP/1.1")
+        http2 = False
+
+    _client = httpx.AsyncClient(
+        timeout=HTTP_CONFIG['timeout'],
+        verify=HTTP_CONFIG['verify'],
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_CONFIG['max_connections'],
+            max_keepalive_connections=HTTP_CONFIG['max_keepalive_connections'],
+            keepalive_expiry=HTTP_CONFIG['keepalive_expiry']
+        )
+    )
+    _client_loop = loop
+    print(f"🌐 Client HTTP partagé initialisé (HTTP/2 : {http2})")
+    return _client
+
+
+async def close_http_client():
+    """Fermer le client partagé et ses connexions ouvertes"""
+    global _client, _client_loop
+    client, _client, _client_loop = _client, None, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
+        print("🌐 Client HTTP partagé fermé")
+
+
+async def open_http_client():
+    """Créer le client partagé sur la boucle courante (démarrage du serveur)"""
+    get_http_client()
+
+
+def shutdown_http_client():
+    """Fermer le client partagé depuis un contexte synchrone (arrêt du serveur)"""
+    if _client is None or _client.is_closed:
+        return
+    loop = _client_loop
+    if loop is None or loop.is_closed():
+        return
+    if loop.is_running():
+        loop.create_task(close_http_client())
+    else:
+        loop.run_until_complete(close_http_client())
+
+
+# Arrêt du serveur : `panel serve` arrête la boucle sans la fermer, le client
+# y est fermé proprement à la sortie du processus (voir server_lifecycle.py)
+atexit.register(shutdown_http_client)
@@ -0,0 +1,265 @@
+"""
+Test de charge des applications de chat contre le backend simulé.
+
+Chaque session simulée exécute le script Panel comme le fait le serveur
+(un Document par session, avec son propre identifiant de session), puis
+envoie ses messages un à un à travers le callback réel de son
+ChatInterface. Le rapport donne les latences p50/p95/p99, le débit et la
+mémoire (RSS) du processus.
+
+    python load_test.py --app websocket --sessions 50 --messages 10
+    python load_test.py --app rest --stream --latency 0.2 --size 4000
+
+Sans navigateur connecté, aucun rendu n'est envoyé au client : seuls le
+traitement côté serveur et la synchronisation des modèles Bokeh sont mesurés.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import inspect
+import io
+import os
+import random
+import runpy
+import statistics
+import time
+import uuid
+from types import SimpleNamespace
+
+# Application -> script Panel
+APPS = {
+    'websocket': 'chatbot_websocket.py',
+    'rest': 'chatbot_openai.py'
+}
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge des applications de chat")
+    parser.add_argument('--app', choices=list(APPS), default='websocket')
+    parser.add_argument('--sessions', type=int, default=20, help="sessions Panel simulées")
+    parser.add_argument('--messages', type=int, default=10, help="messages envoyés par session")
+    parser.add_argument('--stream', action='store_true', help="mode streaming (WEBSOCKET_STREAMING / LLM_STREAMING)")
+    parser.add_argument('--think-time', type=float, default=0.0, help="pause moyenne entre deux messages (s)")
+    parser.add_argument('--ramp', type=float, default=0.0, help="durée de montée en charge (s)")
+    parser.add_argument('--same-query', action='store_true',
+                        help="toutes les sessions posent les mêmes questions (cache, single-flight)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--external', action='store_true', help="utiliser un backend déjà lancé")
+    parser.add_argument('--latency', type=float, default=0.05, help="latence du backend simulé (s)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="gigue du backend simulé (s)")
+    parser.add_argument('--size', type=int, default=500, help="taille des réponses simulées (caractères)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="taux d'erreur du backend simulé")
+    parser.add_argument('--json', dest='json_path', help="écrire les résultats dans ce fichier JSON")
+    parser.add_argument('--verbose', action='store_true', help="afficher les journaux de l'application")
+    parser.add_argument('--metrics', action='store_true', help="afficher les mesures internes (format Prometheus)")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """Les modules de l'application lisent leur configuration à l'import : à appeler avant"""
+    os.environ['WEBSOCKET_HOST'] = args.host
+    os.environ['WEBSOCKET_PORT'] = str(args.port)
+    streaming = 'true' if args.stream else 'false'
+    os.environ['WEBSOCKET_STREAMING'] = streaming
+    os.environ['LLM_STREAMING'] = streaming
+    os.environ.setdefault('WEBSOCKET_POOL_MAX_CLIENTS', str(max(200, args.sessions)))
+
+
+def rss_mb():
+    """Mémoire résidente du processus, en Mo"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        # Hors Linux : pic de mémoire résidente
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class SimulatedSession:
+    """Une session Panel simulée : le script exécuté dans son propre Document"""
+
+    def __init__(self, script, index, args):
+        from bokeh.document import Document
+        from panel.io.state import set_curdoc
+
+        self.id = f"bench-{index}-{uuid.uuid4().hex[:8]}"
+        self.doc = Document()
+        request = SimpleNamespace(arguments={}, cookies={}, headers={})
+        self.context = SimpleNamespace(id=self.id, request=request, _document=self.doc)
+        # Contexte de session minimal : Document.session_context attend une référence faible
+        self.doc._session_context = lambda: self.context
+        with set_curdoc(self.doc):
+            namespace = runpy.run_path(script, run_name=f"bokeh_app_{index}")
+        self.instance = namespace['chat_interface']
+        # Le callback lit ces variables globales du script à chaque appel
+        # (run_path ne retourne qu'une copie des globales du module ; le callback
+        # décoré par traced_callback est déballé pour atteindre celles du script)
+        script_globals = inspect.unwrap(self.instance.callback).__globals__
+        script_globals['user_id'] = self.id
+        if 'llm_endpoint' in script_globals:
+            script_globals['llm_endpoint'] = f"http://{args.host}:{args.port}/v1/user_proxy/ask"
+        self.latencies = []
+        self.errors = 0
+
+    async def ask(self, text):
+        """Envoyer un message comme l'utilisateur et attendre la fin du callback"""
+        instance = self.instance
+        start = time.perf_counter()
+        instance.send(text, user=instance.user, respond=False)
+        result = instance.callback(text, instance.user, instance)
+        reply = None
+        if inspect.isasyncgen(result):
+            async for reply in result:
+                pass
+        elif inspect.isawaitable(result):
+            reply = await result
+        if reply is not None:
+            # Ce que ferait ChatFeed de la valeur produite par le callback
+            instance.send(reply, user=instance.callback_user, respond=False)
+        self.latencies.append(time.perf_counter() - start)
+
+        last = instance.objects[-1] if instance.objects else None
+        if last is None or '⚠️' in str(last.user) or str(last.object).startswith(('❌', 'Erreur', 'Échec')):
+            self.errors += 1
+
+    async def run(self, args, delay=0.0):
+        from panel.io.state import set_curdoc
+
+        # Le Document courant est propre à la tâche (contextvar)
+        with set_curdoc(self.doc):
+            await asyncio.sleep(delay)
+            for i in range(args.messages):
+                owner = 'bench' if args.same_query else self.id
+                await self.ask(f"Question {i} de {owner}")
+                if args.think_time:
+                    await asyncio.sleep(random.expovariate(1 / args.think_time))
+
+    def close(self):
+        """Fermer la session comme à la fermeture de l'onglet"""
+        for callback in list(self.doc.session_destroyed_callbacks):
+            # Ceux de Panel supposent un vrai serveur Bokeh ; seuls ceux de l'application importent ici
+            with contextlib.suppress(Exception):
+                callback(self.context)
+
+
+def summarize(args, sessions, elapsed, load_time, memory):
+    from metrics import CACHE_HITS, CACHE_MISSES, SINGLE_FLIGHT_CALLS, SINGLE_FLIGHT_MERGED
+
+    latencies = sorted(latency for session in sessions for latency in session.latencies)
+    total = len(latencies)
+    if total >= 2:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+    return {
+        'app': args.app,
+        'stream': args.stream,
+        'sessions': len(sessions),
+        'messages_per_session': args.messages,
+        'requests': total,
+        'errors': sum(session.errors for session in sessions),
+        'elapsed_s': elapsed,
+        'throughput_rps': total / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': p50 * 1000,
+            'p95': p95 * 1000,
+            'p99': p99 * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000,
+            'mean': (statistics.fmean(latencies) if latencies else 0.0) * 1000
+        },
+        'session_load_ms': load_time / max(1, len(sessions)) * 1000,
+        'memory_mb': memory,
+        'cache': {
+            'hits': CACHE_HITS.value(),
+            'misses': CACHE_MISSES.value()
+        },
+        'single_flight': {
+            'calls': sum(SINGLE_FLIGHT_CALLS.value(kind=kind) for kind in ('call', 'stream')),
+            'merged': sum(SINGLE_FLIGHT_MERGED.value(kind=kind) for kind in ('call', 'stream'))
+        }
+    }
+
+
+def print_report(results):
+    latency = results['latency_ms']
+    memory = results['memory_mb']
+    print(f"🧪 Application : {results['app']} (streaming : {results['stream']})")
+    print(f"   Sessions : {results['sessions']} × {results['messages_per_session']} messages, "
+          f"chargement {results['session_load_ms']:.1f} ms/session")
+    print(f"   Requêtes : {results['requests']} en {results['elapsed_s']:.2f} s, erreurs : {results['errors']}")
+    print(f"   Débit : {results['throughput_rps']:.1f} req/s")
+    print(f"   Latence (ms) : p50 {latency['p50']:.1f} | p95 {latency['p95']:.1f} | p99 {latency['p99']:.1f} "
+          f"| max {latency['max']:.1f} | moyenne {latency['mean']:.1f}")
+    print(f"   Mémoire RSS (Mo) : départ {memory['start']:.1f} | sessions chargées {memory['loaded']:.1f} "
+          f"({memory['per_session']:.2f}/session) | fin {memory['end']:.1f}")
+    cache = results['cache']
+    if cache['hits'] or cache['misses']:
+        print(f"   Cache : {cache['hits']} succès, {cache['misses']} échecs")
+    flights = results['single_flight']
+    if flights['calls']:
+        print(f"   Single-flight : {flights['calls']} appels au backend, {flights['merged']} requêtes regroupées")
+
+
+async def run(args):
+    from http_client import close_http_client
+    from mock_agent_server import MockAgent, start_mock_server
+    from websocket_client import websocket_pool
+
+    server = None
+    if not args.external:
+        agent = MockAgent(latency=args.latency, jitter=args.jitter, response_size=args.size,
+                          error_rate=args.error_rate)
+        server = start_mock_server(args.host, args.port, agent)
+
+    script = os.path.join(ROOT, APPS[args.app])
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    memory = {'start': rss_mb()}
+    try:
+        with logs:
+            start = time.perf_counter()
+            sessions = [SimulatedSession(script, index, args) for index in range(args.sessions)]
+            load_time = time.perf_counter() - start
+            memory['loaded'] = rss_mb()
+
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                session.run(args, delay=args.ramp * index / max(1, args.sessions))
+                for index, session in enumerate(sessions)
+            ))
+            elapsed = time.perf_counter() - start
+            memory['end'] = rss_mb()
+
+            for session in sessions:
+                session.close()
+            await websocket_pool.close_all()
+            await close_http_client()
+    finally:
+        if server is not None:
+            server.stop()
+
+    memory['per_session'] = (memory['loaded'] - memory['start']) / max(1, args.sessions)
+    return summarize(args, sessions, elapsed, load_time, memory)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.metrics:
+        from metrics import registry
+        print(registry.render())
+    if args.json_path:
+        from codec import dumps
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            f.write(dumps(results))
+
+
+if __name__ == '__main__':
+    main()
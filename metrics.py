@@ -0,0 +1,198 @@
+"""
+Mesures des chemins critiques et point d'entrée /metrics au format Prometheus.
+
+Les compteurs et histogrammes vivent dans ce module importé, partagé par
+toutes les sessions du serveur. Le point d'entrée est servi à côté de
+l'application par le mécanisme de plugins de `panel serve` :
+
+    panel serve chatbot_websocket.py --plugins metrics
+
+La journalisation des contenus (requêtes, réponses) est désactivée par
+défaut ; `PAYLOAD_LOG_RATE` en journalise une fraction, tronquée.
+"""
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import tornado.web
+
+# Configuration des mesures
+METRICS_CONFIG = {
+    # Fraction des contenus journalisés (0 : aucun, 1 : tous)
+    'payload_log_rate': float(os.getenv('PAYLOAD_LOG_RATE', 0.0)),
+    'payload_log_max_chars': int(os.getenv('PAYLOAD_LOG_MAX_CHARS', 200)),
+    # Bornes des histogrammes de durée, en secondes
+    'buckets': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Counter:
+    """Compteur monotone, éventuellement étiqueté"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+
+class Histogram:
+    """Histogramme de durées (secondes), éventuellement étiqueté"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=METRICS_CONFIG['buckets']):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # étiquettes -> [effectifs par borne, somme, nombre]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def timer(self, **labels):
+        """Mesurer la durée du bloc"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(tuple(sorted(labels.items())))
+        return series[2] if series else 0
+
+    def samples(self):
+        for key, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}"
+            yield f"{self.name}_sum{_format_labels(key)} {total}"
+            yield f"{self.name}_count{_format_labels(key)} {count}"
+
+
+class Gauge:
+    """Valeur instantanée, lue par `read()` à chaque exposition"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def samples(self):
+        yield f"{self.name} {self.read()}"
+
+
+class MetricsRegistry:
+    """Ensemble des mesures exposées"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self._register(Counter(name, help))
+
+    def histogram(self, name, help, buckets=METRICS_CONFIG['buckets']):
+        return self._register(Histogram(name, help, buckets))
+
+    def gauge(self, name, help, read):
+        return self._register(Gauge(name, help, read))
+
+    def render(self) -> str:
+        """Exposition au format texte de Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+# Mesures partagées par toutes les sessions du serveur
+registry = MetricsRegistry()
+
+CONNECT_SECONDS = registry.histogram('chat_backend_connect_seconds', "Ouverture d'une connexion au backend")
+SEND_SECONDS = registry.histogram('chat_backend_send_seconds', "Envoi d'une requête au backend")
+FIRST_BYTE_SECONDS = registry.histogram('chat_backend_first_byte_seconds', "Délai avant la première trame de réponse")
+RESPONSE_SECONDS = registry.histogram('chat_backend_response_seconds', "Délai avant la réponse complète")
+RENDER_SECONDS = registry.histogram('chat_render_seconds', "Mise à jour de l'interface de chat")
+REQUESTS = registry.counter('chat_requests_total', "Requêtes envoyées au backend")
+RECONNECTS = registry.counter('chat_backend_reconnects_total', "Reconnexions au backend")
+PINGS = registry.counter('chat_backend_pings_total', "Trames de ping reçues du backend")
+ERRORS = registry.counter('chat_errors_total', "Erreurs, par étape")
+RABBITMQ_MESSAGES = registry.counter('chat_rabbitmq_messages_total', "Messages RabbitMQ reçus")
+CANCELLED = registry.counter('chat_cancelled_total', "Requêtes abandonnées avant leur réponse")
+ADMISSION_WAIT_SECONDS = registry.histogram('chat_admission_wait_seconds', "Attente dans la file d'admission")
+ADMISSION_REJECTED = registry.counter('chat_admission_rejected_total', "Requêtes refusées par le contrôle d'admission")
+CACHE_HITS = registry.counter('chat_cache_hits_total', "Réponses servies depuis le cache")
+CACHE_MISSES = registry.counter('chat_cache_misses_total', "Réponses absentes du cache")
+CACHE_EVICTIONS = registry.counter('chat_cache_evictions_total', "Réponses évincées du cache (expiration ou LRU)")
+SINGLE_FLIGHT_CALLS = registry.counter('chat_single_flight_calls_total', "Appels au backend partagés (single-flight)")
+SINGLE_FLIGHT_MERGED = registry.counter('chat_single_flight_merged_total', "Requêtes servies par un appel déjà en vol")
+
+
+def log_payload(label, payload):
+    """Journaliser un contenu pour une fraction `payload_log_rate` des appels, tronqué"""
+    rate = METRICS_CONFIG['payload_log_rate']
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return
+    text = str(payload)
+    limit = METRICS_CONFIG['payload_log_max_chars']
+    if len(text) > limit:
+        text = text[:limit] + f"… ({len(text)} caractères)"
+    print(f"{label} : {text}")
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """GET /metrics"""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.finish(registry.render())
+
+
+# Routes ajoutées au serveur par `panel serve --plugins metrics`
+ROUTES = [(r"/metrics", MetricsHandler, {})]
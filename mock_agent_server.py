@@ -0,0 +1,278 @@
+"""
+Backend d'agents simulé, pour les tests de charge et le développement local.
+
+Sert sur un même port :
+- `/v1/ws` : message de connexion (session_id), trames de ping, enveloppes
+  de succès/d'erreur, trames partielles `{'type': 'delta'}` en mode
+  streaming, changement d'agent, reprise (`resume_from`), clés
+  d'idempotence (`request_id`) et annulation (`{'type': 'cancel'}`) ;
+- `/v1/user_proxy/ask` : réponse JSON complète, ou flux SSE si
+  `stream=true` et `Accept: text/event-stream`.
+
+Latence, gigue, taille des réponses et taux d'erreur sont configurables.
+
+    python mock_agent_server.py --port 8001 --latency 0.2 --size 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import uuid
+from collections import OrderedDict
+
+import tornado.iostream
+import tornado.web
+import tornado.websocket
+
+from codec import CODECS, JSON_CODEC, dumps
+
+# Configuration du backend simulé
+MOCK_CONFIG = {
+    'host': os.getenv('MOCK_AGENT_HOST', '127.0.0.1'),
+    'port': int(os.getenv('MOCK_AGENT_PORT', 8001)),
+    'latency': float(os.getenv('MOCK_AGENT_LATENCY', 0.05)),  # secondes
+    'jitter': float(os.getenv('MOCK_AGENT_JITTER', 0.0)),
+    'response_size': int(os.getenv('MOCK_AGENT_RESPONSE_SIZE', 500)),  # caractères
+    'chunk_size': int(os.getenv('MOCK_AGENT_CHUNK_SIZE', 20)),
+    'chunk_delay': float(os.getenv('MOCK_AGENT_CHUNK_DELAY', 0.0)),
+    'error_rate': float(os.getenv('MOCK_AGENT_ERROR_RATE', 0.0)),
+    'ping_interval': float(os.getenv('MOCK_AGENT_PING_INTERVAL', 10.0)),
+    'compression': os.getenv('MOCK_AGENT_COMPRESSION', 'true').lower() in ('1', 'true', 'yes')
+}
+
+_FILLER = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+
+
+class MockAgentError(Exception):
+    """Erreur simulée du backend"""
+
+
+class MockAgent:
+    """Comportement commun aux deux points d'entrée : latence, réponses, erreurs"""
+
+    def __init__(self, latency=MOCK_CONFIG['latency'], jitter=MOCK_CONFIG['jitter'],
+                 response_size=MOCK_CONFIG['response_size'], chunk_size=MOCK_CONFIG['chunk_size'],
+                 chunk_delay=MOCK_CONFIG['chunk_delay'], error_rate=MOCK_CONFIG['error_rate'],
+                 max_results=10000):
+        self.latency = latency
+        self.jitter = jitter
+        self.response_size = response_size
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        # Réponses par request_id : une requête rejouée reçoit la même réponse
+        self._results = OrderedDict()
+        self.max_results = max_results
+        self.requests = 0
+        # Requêtes abandonnées par le client avant la fin de la réponse
+        self.cancelled = 0
+
+    async def answer(self, query, request_id=None):
+        """Réponse à `query` après la latence simulée ; MockAgentError selon `error_rate`"""
+        if request_id is not None and request_id in self._results:
+            return self._results[request_id]
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            raise MockAgentError("Erreur simulée du backend")
+        prefix = f"Réponse à « {query} » : "
+        filler = _FILLER * (max(0, self.response_size - len(prefix)) // len(_FILLER) + 1)
+        text = (prefix + filler)[:max(self.response_size, len(prefix))]
+        if request_id is not None:
+            self._results[request_id] = text
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return text
+
+    def chunks(self, text):
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+
+
+class AgentSocketHandler(tornado.websocket.WebSocketHandler):
+    """Point d'entrée WebSocket /v1/ws"""
+
+    def initialize(self, agent, ping_interval, compression):
+        self.agent = agent
+        # Trames de ping applicatives ({'type': 'ping'}), distinctes des pings WebSocket de tornado
+        self.ping_frame_interval = ping_interval
+        self.compression = compression
+        self.codec = JSON_CODEC
+        self.current_agent = 'user_proxy'
+        self._ping_task = None
+        # Requêtes en cours de traitement : request_id -> tâche
+        self._tasks = {}
+
+    def check_origin(self, origin):
+        return True
+
+    def select_subprotocol(self, subprotocols):
+        for subprotocol in subprotocols:
+            for codec in CODECS.values():
+                if codec.subprotocol == subprotocol:
+                    self.codec = codec
+                    return subprotocol
+        return None
+
+    def get_compression_options(self):
+        return {} if self.compression else None
+
+    def open(self):
+        # Session reprise si le client la fournit (reconnexion)
+        self.session_id = self.get_argument('session_id', None) or uuid.uuid4().hex
+        self.send({'status': 'success', 'data': {'session_id': self.session_id}})
+        if self.ping_frame_interval:
+            self._ping_task = asyncio.ensure_future(self._ping())
+
+    def on_close(self):
+        if self._ping_task is not None:
+            self._ping_task.cancel()
+        # Client parti : inutile de terminer les réponses en cours
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+    def on_message(self, message):
+        try:
+            request = self.codec.decode(message)
+        except ValueError:
+            self.send({'status': 'error', 'message': 'Trame invalide'})
+            return
+        request_id = request.get('request_id')
+        if request.get('type') == 'cancel':
+            task = self._tasks.pop(request_id, None)
+            if task is not None:
+                self.agent.cancelled += 1
+                task.cancel()
+            return
+        # Chaque requête est traitée en parallèle des suivantes
+        task = asyncio.ensure_future(self._handle(request))
+        if request_id is not None:
+            self._tasks[request_id] = task
+
+            def forget(done):
+                if self._tasks.get(request_id) is done:
+                    del self._tasks[request_id]
+
+            task.add_done_callback(forget)
+
+    def send(self, obj):
+        """Envoyer une trame, sans erreur si le socket est déjà fermé"""
+        frame = self.codec.encode(obj)
+        try:
+            self.write_message(frame, binary=isinstance(frame, bytes))
+        except tornado.websocket.WebSocketClosedError:
+            pass
+
+    async def _ping(self):
+        while True:
+            await asyncio.sleep(self.ping_frame_interval)
+            self.send({'type': 'ping'})
+
+    async def _handle(self, request):
+        request_id = request.get('request_id')
+        query = str(request.get('query', ''))
+
+        if query.startswith('switch_agent'):
+            self.current_agent = query[len('switch_agent'):].strip() or self.current_agent
+            self.send({'status': 'success', 'request_id': request_id,
+                       'data': {'response': f"Agent actif : {self.current_agent}", 'agent': self.current_agent}})
+            return
+
+        try:
+            text = await self.agent.answer(query, request_id)
+        except MockAgentError as e:
+            self.send({'status': 'error', 'request_id': request_id, 'message': str(e)})
+            return
+
+        if not request.get('stream'):
+            self.send({'status': 'success', 'request_id': request_id,
+                       'data': {'response': text, 'agent': self.current_agent}})
+            return
+
+        chunks = self.agent.chunks(text)
+        for seq in range(int(request.get('resume_from') or 0), len(chunks)):
+            self.send({'type': 'delta', 'request_id': request_id, 'seq': seq,
+                       'data': {'delta': chunks[seq], 'agent': self.current_agent}})
+            if self.agent.chunk_delay:
+                await asyncio.sleep(self.agent.chunk_delay)
+        self.send({'type': 'end', 'request_id': request_id, 'data': {'agent': self.current_agent}})
+
+
+class AskHandler(tornado.web.RequestHandler):
+    """Point d'entrée REST /v1/user_proxy/ask"""
+
+    def initialize(self, agent):
+        self.agent = agent
+
+    async def post(self):
+        query = self.get_argument('query', '')
+        stream = self.get_argument('stream', 'false').lower() in ('1', 'true', 'yes')
+        try:
+            text = await self.agent.answer(query)
+        except MockAgentError as e:
+            self.set_status(502)
+            self.finish({'message': str(e)})
+            return
+
+        if not (stream and 'text/event-stream' in self.request.headers.get('Accept', '')):
+            self.set_header('Content-Type', 'application/json')
+            self.finish(dumps({'content': text}))
+            return
+
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        try:
+            for chunk in self.agent.chunks(text):
+                self.write(f"data: {dumps({'delta': chunk})}\n\n")
+                await self.flush()
+                if self.agent.chunk_delay:
+                    await asyncio.sleep(self.agent.chunk_delay)
+        except tornado.iostream.StreamClosedError:
+            # Client parti (requête interrompue) : flux abandonné
+            self.agent.cancelled += 1
+            return
+        self.finish("data: [DONE]\n\n")
+
+
+def make_app(agent=None, ping_interval=MOCK_CONFIG['ping_interval'], compression=MOCK_CONFIG['compression']):
+    """Application tornado servant les deux points d'entrée du backend simulé"""
+    agent = agent if agent is not None else MockAgent()
+    return tornado.web.Application([
+        (r"/v1/ws", AgentSocketHandler, {'agent': agent, 'ping_interval': ping_interval, 'compression': compression}),
+        (r"/v1/user_proxy/ask", AskHandler, {'agent': agent})
+    ])
+
+
+def start_mock_server(host=MOCK_CONFIG['host'], port=MOCK_CONFIG['port'], agent=None, **app_kwargs):
+    """Démarrer le backend simulé sur la boucle asyncio courante ; retourne le serveur HTTP"""
+    server = make_app(agent, **app_kwargs).listen(port, address=host)
+    print(f"🧪 Backend simulé à l'écoute sur {host}:{port}")
+    return server
+
+
+async def _serve(args):
+    agent = MockAgent(latency=args.latency, jitter=args.jitter, response_size=args.size,
+                      chunk_size=args.chunk_size, chunk_delay=args.chunk_delay, error_rate=args.error_rate)
+    start_mock_server(args.host, args.port, agent, ping_interval=args.ping_interval)
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend d'agents simulé")
+    parser.add_argument('--host', default=MOCK_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=MOCK_CONFIG['port'])
+    parser.add_argument('--latency', type=float, default=MOCK_CONFIG['latency'], help="latence en secondes")
+    parser.add_argument('--jitter', type=float, default=MOCK_CONFIG['jitter'], help="gigue en secondes")
+    parser.add_argument('--size', type=int, default=MOCK_CONFIG['response_size'], help="taille des réponses (caractères)")
+    parser.add_argument('--chunk-size', type=int, default=MOCK_CONFIG['chunk_size'])
+    parser.add_argument('--chunk-delay', type=float, default=MOCK_CONFIG['chunk_delay'])
+    parser.add_argument('--error-rate', type=float, default=MOCK_CONFIG['error_rate'])
+    parser.add_argument('--ping-interval', type=float, default=MOCK_CONFIG['ping_interval'])
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+Consommateur RabbitMQ asynchrone, exécuté sur la boucle asyncio du serveur Panel.
+
+Utilise l'adaptateur asyncio de pika : pas de thread dédié, les messages
+sont rendus depuis la boucle du serveur puis acquittés manuellement.
+Un seul consommateur est partagé par toutes les sessions ; le routeur
+remet chaque message aux seules sessions concernées.
+"""
+
+import asyncio
+import os
+from collections import defaultdict
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from codec import loads
+from metrics import ERRORS, RABBITMQ_MESSAGES
+from reconnect import backoff_delay
+
+# Configuration RabbitMQ
+RABBITMQ_CONFIG = {
+    'host': os.getenv('RABBITMQ_HOST', 'localhost'),
+    'port': int(os.getenv('RABBITMQ_PORT', 30645)),
+    'user': os.getenv('RABBITMQ_USER'),
+    'password': os.getenv('RABBITMQ_PASSWORD'),
+    'queue_name': os.getenv('QUEUE_NAME', 'queue_chatbot'),
+    # Exchange topic optionnel : clés de routage "<préfixe>.<client_id>"
+    'exchange': os.getenv('RABBITMQ_EXCHANGE', ''),
+    'binding_key': os.getenv('RABBITMQ_BINDING_KEY', 'chatbot.*'),
+    # Remettre à toutes les sessions les messages sans destinataire
+    'broadcast_untargeted': os.getenv('RABBITMQ_BROADCAST_UNTARGETED', 'true').lower() in ('1', 'true', 'yes'),
+    # Nombre de messages non acquittés autorisés en vol (contrôle de flux)
+    'prefetch_count': int(os.getenv('RABBITMQ_PREFETCH', 100)),
+    # Regroupement des rafales : au plus N messages, fenêtre d'attente en secondes
+    'batch_size': int(os.getenv('RABBITMQ_BATCH_SIZE', 50)),
+    'batch_window': float(os.getenv('RABBITMQ_BATCH_WINDOW_MS', 20)) / 1000,
+    # Reconnexion : délai exponentiel avec gigue, en secondes
+    'reconnect_base_delay': float(os.getenv('RABBITMQ_RECONNECT_BASE_DELAY', 1.0)),
+    'reconnect_max_delay': float(os.getenv('RABBITMQ_RECONNECT_MAX_DELAY', 60.0))
+}
+
+
+def _resolve(future, result=None, error=None):
+    """Résoudre un Future depuis un callback pika, s'il est encore en attente"""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class RabbitMQConsumer:
+    """Consommateur d'une file RabbitMQ qui délègue les messages par lots à `on_batch`.
+
+    `on_batch(deliveries)` est une coroutine qui reçoit, dans l'ordre de
+    réception, une liste de couples `(body, routing_key)` : jusqu'à
+    `batch_size` messages déjà arrivés ou arrivés pendant `batch_window`.
+    Le lot n'est acquitté qu'une fois la coroutine terminée. En cas
+    d'exception, il est rejeté sans remise en file pour éviter une boucle
+    sur un message invalide.
+    """
+
+    def __init__(self, on_batch, config=RABBITMQ_CONFIG):
+        self.on_batch = on_batch
+        self.config = config
+        self._connection = None
+        self._closed = None
+        self._deliveries = None
+        self._task = None
+        self._stopping = False
+        self._attempt = 0
+
+    def _parameters(self):
+        credentials = pika.PlainCredentials(self.config['user'], self.config['password'])
+        return pika.ConnectionParameters(
+            host=self.config['host'],
+            port=self.config['port'],
+            credentials=credentials,
+            virtual_host='/',
+            socket_timeout=10,  # Timeout de socket en secondes
+            heartbeat=600  # Heartbeat plus long pour éviter les déconnexions
+        )
+
+    async def start(self):
+        """Démarrer la consommation sur la boucle courante"""
+        if self._stopping and self._task is not None and not self._task.done():
+            # Arrêt demandé mais pas encore effectif : attendre la fin de l'ancienne tâche,
+            # sans quoi elle serait prise pour un consommateur actif et jamais relancée
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._task
+
+    def stop(self):
+        """Arrêter la consommation et fermer la connexion"""
+        self._stopping = True
+        if self._connection is not None and not (self._connection.is_closing or self._connection.is_closed):
+            self._connection.close()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await self._consume()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Connexion RabbitMQ perdue : {type(e).__name__} - {e}")
+
+            if self._stopping:
+                break
+
+            delay = backoff_delay(
+                self._attempt, self.config['reconnect_base_delay'], self.config['reconnect_max_delay']
+            )
+            self._attempt += 1
+            print(f"Tentative de reconnexion RabbitMQ n°{self._attempt} dans {delay:.1f} s...")
+            await asyncio.sleep(delay)
+
+    async def _consume(self):
+        """Ouvrir connexion et canal, consommer jusqu'à la fermeture de la connexion"""
+        loop = asyncio.get_running_loop()
+        self._closed = loop.create_future()
+        self._deliveries = asyncio.Queue()
+
+        self._connection = await self._open_connection(loop)
+        channel = await self._open_channel(loop)
+
+        # Déclarer la file d'attente avec des paramètres explicites
+        declared = loop.create_future()
+        channel.queue_declare(
+            queue=self.config['queue_name'],
+            durable=True,  # Rendre la file d'attente durable
+            exclusive=False,
+            auto_delete=False,
+            callback=lambda frame: _resolve(declared, frame)
+        )
+        await declared
+
+        if self.config['exchange']:
+            exchange_declared = loop.create_future()
+            channel.exchange_declare(
+                exchange=self.config['exchange'],
+                exchange_type='topic',
+                durable=True,
+                callback=lambda frame: _resolve(exchange_declared, frame)
+            )
+            await exchange_declared
+
+            bound = loop.create_future()
+            channel.queue_bind(
+                queue=self.config['queue_name'],
+                exchange=self.config['exchange'],
+                routing_key=self.config['binding_key'],
+                callback=lambda frame: _resolve(bound, frame)
+            )
+            await bound
+
+        qos = loop.create_future()
+        channel.basic_qos(prefetch_count=self.config['prefetch_count'], callback=lambda frame: _resolve(qos, frame))
+        await qos
+
+        channel.basic_consume(
+            queue=self.config['queue_name'],
+            on_message_callback=self._on_delivery,
+            auto_ack=False
+        )
+        print(f"Started listening to RabbitMQ queue: {self.config['queue_name']}")
+        self._attempt = 0
+
+        worker = loop.create_task(self._process_deliveries())
+        try:
+            await self._closed
+        finally:
+            worker.cancel()
+
+    def _open_connection(self, loop):
+        opened = loop.create_future()
+        AsyncioConnection(
+            parameters=self._parameters(),
+            on_open_callback=lambda connection: _resolve(opened, connection),
+            on_open_error_callback=lambda connection, error: _resolve(opened, error=pika.exceptions.AMQPConnectionError(error)),
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=loop
+        )
+        return opened
+
+    def _open_channel(self, loop):
+        opened = loop.create_future()
+        channel = self._connection.channel(on_open_callback=lambda channel: _resolve(opened, channel))
+        channel.add_on_close_callback(self._on_channel_closed)
+        return opened
+
+    def _on_connection_closed(self, connection, reason):
+        # Fermeture tardive d'une connexion précédente (arrêt puis redémarrage) : sans effet
+        if connection is not self._connection:
+            return
+        if self._closed is not None:
+            _resolve(self._closed, error=pika.exceptions.StreamLostError(str(reason)))
+
+    def _on_channel_closed(self, channel, reason):
+        if channel.connection is not self._connection:
+            return
+        # Un canal fermé par le broker rend la connexion inutilisable pour nous
+        if self._connection is not None and not (self._connection.is_closing or self._connection.is_closed):
+            self._connection.close()
+        if self._closed is not None:
+            _resolve(self._closed, error=pika.exceptions.AMQPChannelError(str(reason)))
+
+    def _on_delivery(self, channel, method, properties, body):
+        self._deliveries.put_nowait((channel, method.delivery_tag, body, method.routing_key))
+
+    async def _next_batch(self):
+        """Attendre un message puis vider la file jusqu'à `batch_size` messages"""
+        batch = [await self._deliveries.get()]
+        if self._deliveries.empty() and self.config['batch_window'] > 0:
+            # Laisser le temps au reste de la rafale d'arriver
+            await asyncio.sleep(self.config['batch_window'])
+        while len(batch) < self.config['batch_size'] and not self._deliveries.empty():
+            batch.append(self._deliveries.get_nowait())
+        return batch
+
+    async def _process_deliveries(self):
+        """Rendre les messages par lots dans l'ordre, puis acquitter chaque lot"""
+        while True:
+            batch = await self._next_batch()
+            channel = batch[-1][0]
+            last_tag = batch[-1][1]
+            RABBITMQ_MESSAGES.inc(len(batch))
+            try:
+                await self.on_batch([(body, routing_key) for _, _, body, routing_key in batch])
+            except Exception as e:
+                print(f"Erreur lors du traitement d'un lot de {len(batch)} messages : {e}")
+                ERRORS.inc(stage='rabbitmq')
+                if channel.is_open:
+                    channel.basic_nack(last_tag, multiple=True, requeue=False)
+                continue
+            if channel.is_open:
+                channel.basic_ack(last_tag, multiple=True)
+
+
+def decode_message(body: bytes):
+    """Décoder le corps d'un message : dict JSON ou texte brut"""
+    try:
+        return loads(body)
+    except ValueError:
+        return body.decode('utf-8')
+
+
+class SessionRouter:
+    """Index des sessions Panel vivantes et routage des messages RabbitMQ.
+
+    Chaque session s'enregistre avec son identifiant de session, l'identité
+    de son navigateur (`client_id`, envoyée au backend avec chaque requête)
+    et une coroutine de rendu qui reçoit la liste de ses messages. Un
+    message portant `session_id` n'est remis qu'à cette session, un message
+    portant `client_id` (ou `user_id`, ou publié avec la clé de routage
+    "<préfixe>.<client_id>") à toutes les sessions de ce navigateur. Le
+    user_id de l'application, commun à toutes les sessions, ne désigne
+    aucune session. Le consommateur partagé tourne tant qu'une session est
+    enregistrée.
+    """
+
+    def __init__(self, config=RABBITMQ_CONFIG):
+        self.config = config
+        self.consumer = RabbitMQConsumer(on_batch=self.dispatch, config=config)
+        self._sessions = {}  # session_id -> (client_id, handler)
+        self._by_client = defaultdict(set)  # client_id -> {session_id}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def register(self, session_id, client_id, handler):
+        """Enregistrer la coroutine `handler(messages)` d'une session"""
+        self.unregister(session_id, stop_if_empty=False)
+        self._sessions[session_id] = (client_id, handler)
+        self._by_client[client_id].add(session_id)
+        await self.consumer.start()
+
+    def unregister(self, session_id, stop_if_empty=True):
+        """Retirer une session ; arrêter le consommateur s'il n'en reste aucune"""
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            client_sessions = self._by_client[entry[0]]
+            client_sessions.discard(session_id)
+            if not client_sessions:
+                del self._by_client[entry[0]]
+        if stop_if_empty and not self._sessions:
+            self.consumer.stop()
+
+    def targets(self, message_data, routing_key=None):
+        """Sessions destinataires d'un message"""
+        if isinstance(message_data, dict):
+            session_id = message_data.get('session_id')
+            if session_id is not None:
+                return [session_id] if session_id in self._sessions else []
+            target_client = message_data.get('client_id', message_data.get('user_id'))
+        else:
+            target_client = None
+
+        # Exchange topic : le dernier segment de la clé de routage est le client_id
+        if target_client is None and self.config['exchange'] and routing_key and '.' in routing_key:
+            target_client = routing_key.rsplit('.', 1)[1]
+
+        if target_client is not None:
+            return list(self._by_client.get(str(target_client), ()))
+        if self.config['broadcast_untargeted']:
+            return list(self._sessions)
+        return []
+
+    async def dispatch(self, deliveries):
+        """Décoder chaque message une seule fois et remettre à chaque session ses messages en un lot"""
+        per_session = defaultdict(list)
+        for body, routing_key in deliveries:
+            try:
+                message_data = decode_message(body)
+                session_ids = self.targets(message_data, routing_key)
+            except Exception as e:
+                # Un message illisible est écarté seul : le reste du lot est rendu et acquitté
+                print(f"Message RabbitMQ illisible ignoré (clé : {routing_key}) : {type(e).__name__} - {e}")
+                ERRORS.inc(stage='rabbitmq_decode')
+                continue
+            if not session_ids:
+                print(f"Message RabbitMQ sans session destinataire ignoré (clé : {routing_key})")
+                continue
+            for session_id in session_ids:
+                per_session[session_id].append(message_data)
+
+        for session_id, messages in per_session.items():
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                continue
+            try:
+                await entry[1](messages)
+            except Exception as e:
+                print(f"Erreur lors du rendu des messages pour la session {session_id} : {e}")
+
+
+# Routeur partagé par toutes les sessions du serveur
+rabbitmq_router = SessionRouter()
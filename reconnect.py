@@ -0,0 +1,60 @@
+"""
+Politique de reconnexion : délai exponentiel avec gigue et disjoncteur.
+
+Après une série d'échecs, le disjoncteur s'ouvre et les tentatives
+échouent immédiatement pendant `cooldown` secondes, puis de nouvelles
+tentatives sont autorisées (état semi-ouvert) ; le premier succès le
+referme.
+"""
+
+import random
+import time
+
+
+def backoff_delay(attempt: int, base: float, maximum: float) -> float:
+    """Délai exponentiel plafonné avec gigue complète"""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Disjoncteur ouvert après `threshold` échecs consécutifs, pendant `cooldown` secondes"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """Vrai si une tentative peut être faite"""
+        return self.state != self.OPEN
+
+    def retry_in(self) -> float:
+        """Secondes restantes avant la réouverture aux tentatives"""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        # En semi-ouvert, un seul échec suffit à rouvrir pour un nouveau délai
+        if self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                print(f"🔌 Disjoncteur ouvert pour {self.cooldown:.0f} s après {self.failures} échecs")
+            self._opened_at = time.monotonic()
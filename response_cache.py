@@ -0,0 +1,83 @@
+"""
+Cache des réponses du backend pour les requêtes répétées.
+
+Les réponses sont indexées par (requête normalisée, model_id, agent) et
+évincées par LRU au-delà de `max_entries` ou après `ttl` secondes. Le
+cache est partagé par toutes les sessions du serveur et désactivé par
+défaut : une même question peut appeler des réponses différentes selon
+le contexte de la conversation.
+"""
+
+import os
+import re
+import time
+from collections import OrderedDict
+
+from metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES, registry
+
+# Configuration du cache
+CACHE_CONFIG = {
+    'enabled': os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+    'max_entries': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1000)),
+    'ttl': float(os.getenv('RESPONSE_CACHE_TTL', 3600))  # secondes
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Normalisation par défaut : casse et espaces ignorés"""
+    return _WHITESPACE.sub(" ", query).strip().lower()
+
+
+class ResponseCache:
+    """Cache LRU borné en taille et en durée ; succès, échecs et évictions exposés sur /metrics"""
+
+    def __init__(self, max_entries=CACHE_CONFIG['max_entries'], ttl=CACHE_CONFIG['ttl'],
+                 key_normalizer=normalize_query, enabled=CACHE_CONFIG['enabled']):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.key_normalizer = key_normalizer
+        self.enabled = enabled
+        self._entries = OrderedDict()  # clé -> (expiration, valeur)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, query: str, model_id: str, agent: str):
+        return (self.key_normalizer(query), model_id, agent)
+
+    def get(self, query: str, model_id: str, agent: str):
+        """Réponse en cache, ou None"""
+        if not self.enabled:
+            return None
+        key = self.key(query, model_id, agent)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+                CACHE_EVICTIONS.inc()
+            CACHE_MISSES.inc()
+            return None
+        self._entries.move_to_end(key)
+        CACHE_HITS.inc()
+        return entry[1]
+
+    def set(self, query: str, model_id: str, agent: str, value):
+        """Mettre une réponse en cache"""
+        if not self.enabled:
+            return
+        key = self.key(query, model_id, agent)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            CACHE_EVICTIONS.inc()
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Cache partagé par toutes les sessions du serveur
+response_cache = ResponseCache()
+registry.gauge('chat_cache_entries', "Réponses en cache", lambda: len(response_cache))
@@ -0,0 +1,23 @@
+"""
+Cycle de vie du serveur Panel, à passer à `panel serve --setup` :
+
+    panel serve chatbot_openai.py --setup server_lifecycle.py
+
+Au démarrage, le client HTTP partagé est créé sur la boucle du serveur,
+avant la première session. À l'arrêt (Ctrl-C, SIGTERM), `panel serve`
+arrête cette boucle sans la fermer : le client y est fermé, connexions
+comprises, à la sortie du processus (crochet atexit de http_client).
+"""
+
+import os
+import sys
+
+from tornado.ioloop import IOLoop
+
+# Exécuté par `panel serve` hors du répertoire des applications : rendre leurs modules importables
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from http_client import open_http_client  # noqa: E402
+
+# La boucle courante est celle que le serveur Bokeh démarre ensuite
+IOLoop.current().add_callback(open_http_client)
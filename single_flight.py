@@ -0,0 +1,146 @@
+"""
+Déduplication des requêtes identiques en vol (« single-flight »).
+
+Quand plusieurs sessions envoient la même requête au même moment, un seul
+appel au backend est effectué : les autres attendent son résultat, ou
+reçoivent les mêmes fragments lorsqu'il s'agit d'un flux. L'appel partagé
+n'est annulé que lorsque plus aucun appelant ne l'attend. Désactivé par
+défaut, pour la même raison que le cache de réponses.
+"""
+
+import asyncio
+import os
+
+from metrics import SINGLE_FLIGHT_CALLS, SINGLE_FLIGHT_MERGED, registry
+from response_cache import normalize_query
+
+SINGLE_FLIGHT_CONFIG = {
+    'enabled': os.getenv('SINGLE_FLIGHT_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+}
+
+# Fin de flux, transmise aux abonnés
+_END = object()
+
+
+class _Failure:
+    """Exception du flux, transmise aux abonnés"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class _StreamFlight:
+    """Flux en vol : fragments déjà reçus et files des abonnés"""
+
+    def __init__(self):
+        self.buffer = []
+        self.subscribers = []
+        self.task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue()
+        for item in self.buffer:
+            queue.put_nowait(item)
+        self.subscribers.append(queue)
+        return queue
+
+    def publish(self, item):
+        self.buffer.append(item)
+        for queue in self.subscribers:
+            queue.put_nowait(item)
+
+
+class SingleFlight:
+    """Regroupe les appels concurrents portant la même clé en un seul appel"""
+
+    def __init__(self, enabled=SINGLE_FLIGHT_CONFIG['enabled']):
+        self.enabled = enabled
+        self._calls = {}
+        # Appelants en attente de chaque appel partagé
+        self._waiting = {}
+        self._streams = {}
+
+    @staticmethod
+    def key(query: str, model_id: str, agent: str):
+        return (normalize_query(query), model_id, agent)
+
+    async def do(self, key, factory):
+        """Retourner le résultat de `factory()`, partagé avec les appels concurrents de même clé"""
+        if not self.enabled:
+            return await factory()
+
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(self._calls, key, done))
+            SINGLE_FLIGHT_CALLS.inc(kind='call')
+        else:
+            SINGLE_FLIGHT_MERGED.inc(kind='call')
+        # L'annulation d'un appelant n'interrompt pas l'appel partagé, sauf s'il était le dernier
+        self._waiting[task] = self._waiting.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiting[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiting[task] -= 1
+            if not self._waiting[task]:
+                del self._waiting[task]
+
+    async def stream(self, key, factory):
+        """Produire les éléments de `factory()` (générateur asynchrone), partagés entre appels concurrents"""
+        if not self.enabled:
+            async for item in factory():
+                yield item
+            return
+
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._pump(key, flight, factory))
+            SINGLE_FLIGHT_CALLS.inc(kind='stream')
+        else:
+            SINGLE_FLIGHT_MERGED.inc(kind='stream')
+
+        queue = flight.subscribe()
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            flight.subscribers.remove(queue)
+            # Dernier abonné parti avant la fin : interrompre la lecture du flux source
+            if not flight.subscribers and not flight.task.done():
+                flight.task.cancel()
+
+    async def _pump(self, key, flight, factory):
+        """Lire le flux source et le diffuser à tous les abonnés"""
+        try:
+            async for item in factory():
+                flight.publish(item)
+        except Exception as e:
+            flight.publish(_Failure(e))
+        finally:
+            self._forget(self._streams, key, flight)
+            flight.publish(_END)
+
+    @staticmethod
+    def _forget(flights, key, value):
+        if flights.get(key) is value:
+            del flights[key]
+
+    def __len__(self):
+        return len(self._calls) + len(self._streams)
+
+
+# Déduplication partagée par toutes les sessions du serveur
+single_flight = SingleFlight()
+registry.gauge('chat_single_flight_in_flight', "Appels partagés en vol", lambda: len(single_flight))
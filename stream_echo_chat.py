@@ -7,25 +7,31 @@ The chatbot Assistant echoes back the message entered by the User in an
 
 Highlights:
 
-- The function is defined as `async` and uses `yield` to stream back responses.
-- Initialize `message` first to gather the characters and then `yield` it;
-    without it, only one letter would be displayed at a time.
+- The function is defined as `async` and produces the reply as an async
+    generator of small chunks (deltas), like an LLM token stream.
+- `stream_to_message` buffers the chunks and appends them to a single
+    message at a bounded frame rate, instead of re-sending the whole
+    accumulated string for every character.
 """
 
 from asyncio import sleep
 
 import panel as pn
 
+from chat_streaming import stream_to_message
+
 pn.extension()
 
 
-async def callback(contents: str, user: str, instance: pn.chat.ChatInterface):
-    await sleep(1)
-    message = ""
+async def echo_tokens(contents: str):
     for char in "Echoing User: " + contents:
         await sleep(0.05)
-        message += char
-        yield message
+        yield char
+
+
+async def callback(contents: str, user: str, instance: pn.chat.ChatInterface):
+    await sleep(1)
+    await stream_to_message(instance, echo_tokens(contents), user="Assistant")
 
 
 chat_interface = pn.chat.ChatInterface(callback=callback)
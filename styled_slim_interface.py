@@ -6,10 +6,14 @@ Highlights:
 - The `ChatInterface` is placed in the sidebar.
 - Set `show_*` parameters to `False` to hide the respective buttons.
 - Use `message_params` to customize the appearance of each chat messages.
+- Use `load_buffer` and `WindowedHistory` to keep only the most recent
+    messages live, so long conversations stay light in the sidebar.
 """
 
 import panel as pn
 
+from chat_window import WINDOW_CONFIG, WindowedHistory
+
 pn.extension()
 
 
@@ -30,6 +34,7 @@ chat_interface = pn.chat.ChatInterface(
     show_reaction_icons=False,
     sizing_mode="stretch_width",
     height=700,
+    load_buffer=WINDOW_CONFIG["load_buffer"],
     message_params={
         "stylesheets": [
             """
@@ -47,6 +52,8 @@ chat_interface = pn.chat.ChatInterface(
     },
 )
 
+history = WindowedHistory(chat_interface)
+
 main = """
 We've put a *slim* `ChatInterface` in the sidebar. In the main area you
 could add the object you are chatting about
@@ -54,6 +61,6 @@ could add the object you are chatting about
 
 pn.template.FastListTemplate(
     main=[main],
-    sidebar=[chat_interface],
+    sidebar=[history.load_button, chat_interface],
     sidebar_width=500,
 ).servable()
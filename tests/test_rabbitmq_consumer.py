@@ -0,0 +1,41 @@
+"""
+Arrêt et redémarrage du consommateur RabbitMQ partagé.
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rabbitmq_consumer import RABBITMQ_CONFIG, RabbitMQConsumer
+
+# Broker injoignable : le consommateur reste dans sa boucle de reconnexion
+UNREACHABLE = {**RABBITMQ_CONFIG, 'host': '127.0.0.1', 'port': 1, 'user': 'guest', 'password': 'guest',
+               'reconnect_base_delay': 30.0, 'reconnect_max_delay': 30.0}
+
+
+async def _on_batch(deliveries):
+    pass
+
+
+async def _restart_before_stopped():
+    consumer = RabbitMQConsumer(on_batch=_on_batch, config=UNREACHABLE)
+    first = await consumer.start()
+    await asyncio.sleep(0.1)
+
+    # Dernière session fermée puis nouvelle session, avant la fin effective de l'arrêt
+    consumer.stop()
+    second = await consumer.start()
+    await asyncio.sleep(0.1)
+    running = not second.done()
+    consumer.stop()
+    await asyncio.gather(second, return_exceptions=True)
+    return first, second, running
+
+
+def test_start_after_stop_runs_a_new_consumer():
+    first, second, running = asyncio.run(_restart_before_stopped())
+    assert first.cancelled()
+    assert second is not first
+    assert running
@@ -0,0 +1,77 @@
+"""
+Routage des messages RabbitMQ entre sessions qui partagent le user_id de l'application.
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rabbitmq_consumer import RABBITMQ_CONFIG, SessionRouter
+
+
+class _IdleConsumer:
+    """Consommateur sans connexion au broker : seul le routage est testé"""
+
+    async def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def _router(**config):
+    router = SessionRouter(config={**RABBITMQ_CONFIG, **config})
+    router.consumer = _IdleConsumer()
+    return router
+
+
+async def _route(router, deliveries):
+    """Enregistrer deux sessions du même user_id applicatif, puis remettre `deliveries`"""
+    received = {'a': [], 'b': []}
+
+    async def render_a(messages):
+        received['a'].extend(messages)
+
+    async def render_b(messages):
+        received['b'].extend(messages)
+
+    # Même user_id applicatif ('vinh') : seules les identités de session et de navigateur diffèrent
+    await router.register('a', 'session:a', render_a)
+    await router.register('b', 'session:b', render_b)
+    await router.dispatch([(json.dumps(body).encode(), key) for body, key in deliveries])
+    return received
+
+
+def test_session_id_reaches_only_that_session():
+    received = asyncio.run(_route(_router(), [({'session_id': 'a', 'content': 'pour a'}, 'queue_chatbot')]))
+    assert [m['content'] for m in received['a']] == ['pour a']
+    assert received['b'] == []
+
+
+def test_client_id_reaches_only_that_browser():
+    received = asyncio.run(_route(_router(), [({'client_id': 'session:b', 'content': 'pour b'}, 'queue_chatbot')]))
+    assert received['a'] == []
+    assert [m['content'] for m in received['b']] == ['pour b']
+
+
+def test_shared_app_user_id_reaches_no_session():
+    received = asyncio.run(_route(_router(), [({'user_id': 'vinh', 'content': 'pour tous ?'}, 'queue_chatbot')]))
+    assert received == {'a': [], 'b': []}
+
+
+def test_topic_routing_key_targets_one_browser():
+    router = _router(exchange='chatbot')
+    received = asyncio.run(_route(router, [
+        ({'content': 'pour a'}, 'chatbot.session:a'),
+        ({'content': 'pour vinh'}, 'chatbot.vinh'),
+    ]))
+    assert [m['content'] for m in received['a']] == ['pour a']
+    assert received['b'] == []
+
+
+def test_untargeted_message_is_broadcast_when_enabled():
+    received = asyncio.run(_route(_router(broadcast_untargeted=True), [({'content': 'annonce'}, 'queue_chatbot')]))
+    assert len(received['a']) == len(received['b']) == 1
@@ -0,0 +1,71 @@
+"""
+Reprise d'un flux WebSocket après une coupure, avec un backend simulé minimal.
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from websocket_client import WebSocketClient
+
+CHUNKS = [f"part{i} " for i in range(6)]
+
+
+async def _resumed_text(with_seq, honour_resume_from=True):
+    """Texte reçu d'un flux coupé après deux fragments puis repris sur une nouvelle connexion"""
+
+    async def handler(websocket):
+        await websocket.send(json.dumps({'status': 'success', 'data': {'session_id': 's1'}}))
+        async for frame in websocket:
+            request = json.loads(frame)
+            if request.get('type') == 'cancel':
+                continue
+            request_id = request['request_id']
+            if not request.get('resume'):
+                # Première connexion : deux fragments, puis coupure
+                start, stop = 0, 2
+            else:
+                start = int(request.get('resume_from') or 0) if honour_resume_from else 0
+                stop = len(CHUNKS)
+            for seq in range(start, stop):
+                delta = {'type': 'delta', 'request_id': request_id, 'data': {'delta': CHUNKS[seq]}}
+                if with_seq:
+                    delta['seq'] = seq
+                await websocket.send(json.dumps(delta))
+            if stop < len(CHUNKS):
+                await websocket.close()
+                return
+            await websocket.send(json.dumps({'type': 'end', 'request_id': request_id, 'data': {}}))
+
+    async with websockets.serve(handler, 'localhost', 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        client = WebSocketClient('test', host='localhost', port=port, path='/')
+        try:
+            parts = []
+            async for frame in client.stream_message(f"question {with_seq} {honour_resume_from}"):
+                if frame.get('type') == 'delta':
+                    parts.append(frame['data']['delta'])
+            return ''.join(parts)
+        finally:
+            await client.close()
+
+
+def test_resume_without_seq_keeps_every_chunk():
+    text = asyncio.run(asyncio.wait_for(_resumed_text(with_seq=False), 10))
+    assert text == ''.join(CHUNKS)
+
+
+def test_resume_with_seq_keeps_every_chunk():
+    text = asyncio.run(asyncio.wait_for(_resumed_text(with_seq=True), 10))
+    assert text == ''.join(CHUNKS)
+
+
+def test_replayed_chunks_with_seq_are_not_duplicated():
+    # Backend qui ignore resume_from et renvoie tout le flux : `seq` écarte les doublons
+    text = asyncio.run(asyncio.wait_for(_resumed_text(with_seq=True, honour_resume_from=False), 10))
+    assert text == ''.join(CHUNKS)
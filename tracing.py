@@ -0,0 +1,244 @@
+"""
+Traces de bout en bout : du message de l'utilisateur jusqu'au backend.
+
+Chaque message traité ouvre une trace ; son `trace_id` est transmis au
+backend avec le `session_id` (trames WebSocket, paramètres et en-tête
+`traceparent` des requêtes REST). Les étapes (attente du callback,
+message d'attente, aller-retour avec le backend, rendu) sont mesurées
+par des spans, exportés par lots vers un fichier JSON Lines ou vers un
+collecteur au format OTLP/JSON. Désactivé par défaut.
+"""
+
+import asyncio
+import atexit
+import contextvars
+import functools
+import inspect
+import os
+import random
+import secrets
+import time
+from contextlib import contextmanager, suppress
+from datetime import datetime
+
+from codec import dumps
+
+# Configuration des traces
+TRACE_CONFIG = {
+    'enabled': os.getenv('TRACE_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+    # Fraction des traces dont les spans sont exportés (les identifiants sont toujours transmis)
+    'sample_rate': float(os.getenv('TRACE_SAMPLE_RATE', 1.0)),
+    # Fichier JSON Lines des spans
+    'file': os.getenv('TRACE_FILE', ''),
+    # Collecteur OTLP/HTTP au format JSON, par exemple http://localhost:4318/v1/traces
+    'otlp_endpoint': os.getenv('TRACE_OTLP_ENDPOINT', ''),
+    'service_name': os.getenv('TRACE_SERVICE_NAME', 'panel-chat'),
+    'batch_size': int(os.getenv('TRACE_BATCH_SIZE', 100)),
+    'flush_interval': float(os.getenv('TRACE_FLUSH_INTERVAL', 5.0))  # secondes
+}
+
+# Span courant de la tâche (ou du callback) en cours
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """Étape mesurée d'une trace"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'sampled', 'start_ns', 'end_ns')
+
+    def __init__(self, trace_id, name, parent_id=None, sampled=True, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        """En-tête W3C Trace Context"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': (self.end_ns - self.start_ns) / 1e6,
+            'attributes': self.attributes
+        }
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()]
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class SpanExporter:
+    """Exporte les spans terminés par lots, vers un fichier et/ou un collecteur OTLP"""
+
+    def __init__(self, path=TRACE_CONFIG['file'], otlp_endpoint=TRACE_CONFIG['otlp_endpoint'],
+                 batch_size=TRACE_CONFIG['batch_size'], flush_interval=TRACE_CONFIG['flush_interval']):
+        self.path = path
+        self.otlp_endpoint = otlp_endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def record(self, span):
+        self._buffer.append(span)
+        if len(self._buffer) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Écrire le lot courant ; l'envoi au collecteur se fait en tâche de fond"""
+        spans, self._buffer = self._buffer, []
+        self._last_flush = time.monotonic()
+        if not spans:
+            return
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.writelines(dumps(span.to_dict()) + "\n" for span in spans)
+        if self.otlp_endpoint:
+            try:
+                asyncio.get_running_loop().create_task(self._post(spans))
+            except RuntimeError:
+                # Hors boucle asyncio (arrêt du processus) : lot abandonné pour le collecteur
+                pass
+
+    async def _post(self, spans):
+        from http_client import get_http_client
+
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': TRACE_CONFIG['service_name']}}
+            ]},
+            'scopeSpans': [{'scope': {'name': TRACE_CONFIG['service_name']},
+                            'spans': [span.to_otlp() for span in spans]}]
+        }]}
+        try:
+            await get_http_client().post(self.otlp_endpoint, content=dumps(payload),
+                                         headers={'content-type': 'application/json'})
+        except Exception as e:
+            print(f"⚠️ Export des traces impossible : {type(e).__name__} - {str(e)}")
+
+
+exporter = SpanExporter()
+atexit.register(exporter.flush)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_trace_id():
+    """Identifiant de la trace en cours, à transmettre au backend, ou None"""
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+def trace_headers():
+    """En-têtes HTTP de propagation de la trace en cours"""
+    span = _current_span.get()
+    return {'traceparent': span.traceparent} if span is not None else {}
+
+
+@contextmanager
+def span(name, **attributes):
+    """Mesurer une étape de la trace en cours (sans effet hors trace)"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace_id, name, parent.span_id, parent.sampled, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        _reset(token)
+        _finish(child)
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """Ouvrir une nouvelle trace dont ce span est la racine (sans effet si désactivé)"""
+    if not TRACE_CONFIG['enabled']:
+        yield None
+        return
+    sampled = random.random() < TRACE_CONFIG['sample_rate']
+    root = Span(secrets.token_hex(16), name, sampled=sampled, attributes=attributes)
+    token = _current_span.set(root)
+    try:
+        yield root
+    finally:
+        _reset(token)
+        _finish(root)
+
+
+@contextmanager
+def trace_callback(name, instance, **attributes):
+    """Trace d'un callback de ChatInterface, avec l'attente depuis l'envoi du message"""
+    with start_trace(name, **attributes) as root:
+        if root is not None and instance.objects:
+            timestamp = instance.objects[-1].timestamp
+            if isinstance(timestamp, datetime) and timestamp.tzinfo is None:
+                root.set(dispatch_delay_ms=(datetime.now() - timestamp).total_seconds() * 1000)
+        yield root
+
+
+def traced_callback(name, **attributes):
+    """Décorateur : une trace par appel d'un callback (coroutine ou générateur asynchrone)"""
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def wrapper(contents, user, instance):
+                with trace_callback(name, instance, user=user, **attributes):
+                    async for item in func(contents, user, instance):
+                        yield item
+        else:
+            @functools.wraps(func)
+            async def wrapper(contents, user, instance):
+                with trace_callback(name, instance, user=user, **attributes):
+                    return await func(contents, user, instance)
+        return wrapper
+    return decorator
+
+
+def _reset(token):
+    # Générateur asynchrone finalisé hors de la tâche qui l'a démarré : contexte déjà perdu
+    with suppress(ValueError):
+        _current_span.reset(token)
+
+
+def _finish(span):
+    span.end_ns = time.time_ns()
+    if span.sampled:
+        exporter.record(span)
@@ -0,0 +1,677 @@
+"""
+Client WebSocket vers le backend d'agents et pool de connexions par session.
+
+Le script Panel est ré-exécuté pour chaque session navigateur : le pool vit
+donc dans ce module importé afin d'être partagé par toutes les sessions du
+serveur.
+"""
+
+import asyncio
+import os
+import time
+import urllib.parse
+import uuid
+from collections import OrderedDict
+from functools import partial
+
+import websockets
+
+from codec import JSON_CODEC, codec_for, compression, offered_subprotocols, validate_envelope
+from metrics import (CANCELLED, CONNECT_SECONDS, ERRORS, FIRST_BYTE_SECONDS, PINGS, RECONNECTS, REQUESTS,
+                     RESPONSE_SECONDS, SEND_SECONDS, log_payload)
+from reconnect import CircuitBreaker, backoff_delay
+from response_cache import response_cache
+from single_flight import single_flight
+from tracing import current_trace_id, span
+
+# Configuration WebSocket
+WEBSOCKET_CONFIG = {
+    'host': os.getenv('WEBSOCKET_HOST', 'localhost'),  
+    'port': int(os.getenv('WEBSOCKET_PORT', 8001)),       
+    'path': '/v1/ws',
+    # Mode streaming : le backend renvoie des trames partielles {'type': 'delta'}
+    'streaming': os.getenv('WEBSOCKET_STREAMING', 'false').lower() in ('1', 'true', 'yes'),
+    # Délai maximal sans trame de réponse pour une requête en vol (0 : aucun)
+    'response_timeout': float(os.getenv('WEBSOCKET_RESPONSE_TIMEOUT', 120.0))  # secondes
+}
+
+# Configuration du pool de connexions
+POOL_CONFIG = {
+    'max_clients': int(os.getenv('WEBSOCKET_POOL_MAX_CLIENTS', 200)),
+    'idle_ttl': float(os.getenv('WEBSOCKET_POOL_IDLE_TTL', 900))  # secondes
+}
+
+# Reconnexion : délai exponentiel avec gigue, disjoncteur partagé par tous les
+# clients et nombre borné de connexions ouvertes simultanément
+RECONNECT_CONFIG = {
+    'base_delay': float(os.getenv('WEBSOCKET_RECONNECT_BASE_DELAY', 0.5)),  # secondes
+    'max_delay': float(os.getenv('WEBSOCKET_RECONNECT_MAX_DELAY', 30.0)),
+    'max_attempts': int(os.getenv('WEBSOCKET_RECONNECT_MAX_ATTEMPTS', 5)),
+    'breaker_threshold': int(os.getenv('WEBSOCKET_BREAKER_THRESHOLD', 10)),
+    'breaker_cooldown': float(os.getenv('WEBSOCKET_BREAKER_COOLDOWN', 30.0)),
+    'max_concurrent_connects': int(os.getenv('WEBSOCKET_MAX_CONCURRENT_CONNECTS', 10))
+}
+
+DEFAULT_MODEL_ID: str = 'gpt-4o-mini'
+DEFAULT_AGENT: str = 'user_proxy'
+
+# Commande de changement d'agent ("switch_agent <nom>")
+SWITCH_AGENT_COMMAND = 'switch_agent'
+
+# Type des trames partielles ; toute autre trame termine un flux
+DELTA_FRAME_TYPE = 'delta'
+
+# Trame envoyée au backend pour abandonner une requête en cours
+CANCEL_FRAME_TYPE = 'cancel'
+
+
+def is_final_frame(frame) -> bool:
+    """Vrai si la trame clôt la réponse (succès, erreur ou fin de flux)"""
+    return not (isinstance(frame, dict) and frame.get('type') == DELTA_FRAME_TYPE)
+
+
+# Un même backend pour toutes les sessions : ses échecs sont comptés ensemble,
+# et un redémarrage ne provoque pas l'ouverture simultanée de tous les sockets
+connect_breaker = CircuitBreaker(RECONNECT_CONFIG['breaker_threshold'], RECONNECT_CONFIG['breaker_cooldown'])
+connect_slots = asyncio.Semaphore(RECONNECT_CONFIG['max_concurrent_connects'])
+
+
+class _Outbound:
+    """Requête en vol, conservée jusqu'à sa réponse finale pour être rejouée après reconnexion"""
+
+    __slots__ = ('message', 'stream', 'target', 'trace_id', 'replayed', 'received', 'seen', 'sent_at', 'answered',
+                 'timer')
+
+    def __init__(self, message, stream, target, trace_id=None):
+        self.message = message
+        self.stream = stream
+        # Trace du message d'origine, conservée pour une éventuelle reprise
+        self.trace_id = trace_id
+        # Future de la réponse, ou file des trames en mode streaming
+        self.target = target
+        self.replayed = False
+        # Fragments remis au consommateur, et fragments vus depuis le dernier envoi
+        self.received = 0
+        self.seen = 0
+        # Premier envoi et première trame reçue (mesures)
+        self.sent_at = None
+        self.answered = False
+        # Échéance du délai de réponse, réarmée à chaque trame reçue
+        self.timer = None
+
+
+class WebSocketClient:
+    def __init__(self, user_id, host='localhost', port=8001, path='/v1/ws',
+                 model_id=DEFAULT_MODEL_ID, on_status_change=None, cache=None, breaker=None):
+        self.user_id = user_id
+        self.model_id = model_id
+        # Agent actif côté backend, suivi pour la clé du cache de réponses
+        self.agent = DEFAULT_AGENT
+        self.cache = cache if cache is not None else response_cache
+        self.breaker = breaker if breaker is not None else connect_breaker
+        # Fonction appelée avec True/False à chaque changement d'état
+        self.on_status_change = on_status_change
+        self.host = host
+        self.port = port
+        self.path = path
+        self.uri = f"ws://{host}:{port}{path}?user_id={urllib.parse.quote(user_id)}"
+        self.websocket = None
+        self.codec = JSON_CODEC
+        self.connected = False
+        self._connect_task = None
+        self._session_id = None
+        # Requêtes en vol : request_id -> _Outbound
+        self._pending = {}
+        self._reader_task = None
+        self._recover_task = None
+        # Envois de trames d'annulation en cours
+        self._cancel_tasks = set()
+        # Horodatage de la dernière utilisation, consulté par le pool
+        self.last_used = time.monotonic()
+        print(f"WebSocket URI initialisée : {self.uri}")
+
+    def _set_connected(self, is_connected: bool):
+        """Mettre à jour l'état de connexion et prévenir l'interface"""
+        self.connected = is_connected
+        if self.on_status_change:
+            self.on_status_change(is_connected)
+
+    @property
+    def busy(self):
+        """Vrai si des requêtes attendent encore une réponse"""
+        return bool(self._pending)
+
+    async def connect(self):
+        if self.connected:
+            return True
+            
+        if self._connect_task and not self._connect_task.done():
+            return await self._connect_task
+        
+        self._connect_task = asyncio.create_task(self._connect())
+        return await self._connect_task
+
+    async def _connect(self):
+        """Se connecter en au plus `max_attempts` tentatives espacées d'un délai exponentiel"""
+        max_attempts = RECONNECT_CONFIG['max_attempts']
+        for attempt in range(max_attempts):
+            if attempt:
+                delay = backoff_delay(attempt - 1, RECONNECT_CONFIG['base_delay'], RECONNECT_CONFIG['max_delay'])
+                print(f"⏳ Nouvelle tentative de connexion dans {delay:.1f} s ({attempt + 1}/{max_attempts})")
+                await asyncio.sleep(delay)
+            # Disjoncteur ouvert : échec immédiat, sans solliciter le backend
+            if not self.breaker.allow():
+                print(f"🔌 Backend indisponible, prochain essai dans {self.breaker.retry_in():.0f} s")
+                break
+            if await self._open():
+                self.breaker.record_success()
+                return True
+            self.breaker.record_failure()
+        return False
+
+    async def _open(self):
+        """Ouvrir le socket et lire le message de connexion (une tentative)"""
+        start = time.perf_counter()
+        reconnect = self._session_id is not None
+        try:
+            uri = self.uri
+            if self._session_id:
+                # Reconnexion : demander au backend de reprendre la même session
+                uri += f"&session_id={urllib.parse.quote(self._session_id)}"
+            async with connect_slots:
+                print(f"Tentative de connexion à : {uri}")
+                self.websocket = await websockets.connect(
+                    uri,
+                    ping_interval=20,
+                    ping_timeout=20,
+                    # Codec des trames et compression négociés à l'ouverture
+                    subprotocols=offered_subprotocols() or None,
+                    compression=compression()
+                )
+                self.codec = codec_for(self.websocket.subprotocol)
+                self._set_connected(True)
+                print(f"✅ Connexion WebSocket établie (codec : {self.codec.name})")
+                
+                # Recevoir et traiter le message de connexion
+                connection_response = await self.websocket.recv()
+            connection_data = validate_envelope(self.codec.decode(connection_response))
+            
+            if connection_data.get('status') == 'success':
+                self._session_id = connection_data.get('data', {}).get('session_id')
+                print(f"📡 Session ID obtenu : {self._session_id}")
+            
+            CONNECT_SECONDS.observe(time.perf_counter() - start, transport='websocket')
+            if reconnect:
+                RECONNECTS.inc(transport='websocket')
+
+            # Un seul lecteur par socket : il route chaque trame vers sa requête
+            self._reader_task = asyncio.create_task(self._reader_loop())
+            
+            # Lancer une tâche pour surveiller la connexion
+            asyncio.create_task(self._monitor_connection())
+            
+            return True
+        except Exception as e:
+            print(f"❌ Erreur de connexion WebSocket : {type(e).__name__} - {str(e)}")
+            ERRORS.inc(stage='connect')
+            self._set_connected(False)
+            return False
+
+    async def _monitor_connection(self):
+        """Surveiller en continu l'état de la connexion"""
+        try:
+            while self.connected:
+                try:
+                    # Envoyer un ping
+                    await self.websocket.ping()
+                    await asyncio.sleep(15)  # Vérifier toutes les 15 secondes
+                except websockets.exceptions.ConnectionClosed:
+                    print("❌ Connexion WebSocket fermée de manière inattendue")
+                    self._set_connected(False)
+                    # Reconnexion avec délai exponentiel (voir _connect)
+                    await self.connect()
+                    break
+        except Exception as e:
+            print(f"❌ Erreur lors de la surveillance de la connexion : {str(e)}")
+
+    async def _reader_loop(self):
+        """Lire en continu les trames du socket et les router vers les requêtes en attente"""
+        try:
+            async for frame in self.websocket:
+                try:
+                    # Trame malformée rejetée avant tout routage
+                    response_data = validate_envelope(self.codec.decode(frame))
+                except ValueError as e:
+                    print(f"⚠️ Trame invalide ignorée ({e})")
+                    log_payload("⚠️ Trame invalide", frame)
+                    ERRORS.inc(stage='decode')
+                    continue
+                
+                # Ignorer les messages de ping (comptés seulement)
+                if response_data.get('type') == 'ping':
+                    PINGS.inc()
+                    continue
+                
+                self._dispatch(response_data)
+        except websockets.exceptions.ConnectionClosed:
+            print("❌ Connexion WebSocket fermée pendant la lecture")
+        except Exception as e:
+            print(f"❌ Erreur dans la boucle de lecture : {type(e).__name__} - {str(e)}")
+        finally:
+            self._set_connected(False)
+            # Les requêtes en vol ne sont pas perdues : elles seront rejouées après reconnexion
+            self._schedule_recover()
+
+    def _schedule_recover(self):
+        if self._pending and (self._recover_task is None or self._recover_task.done()):
+            self._recover_task = asyncio.create_task(self._recover())
+
+    async def _recover(self):
+        """Se reconnecter puis rejouer une fois chaque requête en vol.
+
+        Le request_id sert de clé d'idempotence : le backend reconnaît une
+        requête déjà reçue au lieu de la traiter une seconde fois. Une
+        requête déjà rejouée qui perd de nouveau sa connexion échoue.
+        """
+        if not await self.connect():
+            self._fail_pending(ConnectionError("Connexion WebSocket perdue"))
+            return
+        for request_id, entry in list(self._pending.items()):
+            if entry.replayed:
+                self._fail(request_id, ConnectionError("Connexion WebSocket perdue pendant la reprise"))
+                continue
+            entry.replayed = True
+            # Le backend reprend le flux à `resume_from` : sans `seq`, la première trame
+            # rejouée porte cet indice
+            entry.seen = entry.received
+            print(f"🔁 Requête rejouée après reconnexion : {request_id}")
+            await self._send_payload(request_id, entry)
+
+        # Connexion perdue de nouveau pendant la reprise : la demande de reprise du lecteur
+        # ou de _send_payload a été ignorée, cette tâche n'étant pas terminée
+        if not self.connected:
+            for request_id, entry in list(self._pending.items()):
+                if entry.replayed:
+                    self._fail(request_id, ConnectionError("Connexion WebSocket perdue pendant la reprise"))
+            # Requêtes arrivées pendant la reprise : nouvelle reprise, une fois celle-ci terminée
+            asyncio.get_running_loop().call_soon(self._schedule_recover)
+
+    async def _send_payload(self, request_id, entry):
+        """Envoyer (ou renvoyer) la requête `entry` sur le socket courant"""
+        message_payload = self._build_payload(entry.message, request_id, stream=entry.stream, trace_id=entry.trace_id)
+        if entry.replayed:
+            message_payload["resume"] = True
+            if entry.stream:
+                # Fragments déjà reçus : le backend peut reprendre le flux à cet indice
+                message_payload["resume_from"] = entry.received
+        try:
+            start = time.perf_counter()
+            await self.websocket.send(self.codec.encode(message_payload))
+            SEND_SECONDS.observe(time.perf_counter() - start, transport='websocket')
+            if entry.sent_at is None:
+                entry.sent_at = start
+                REQUESTS.inc(transport='websocket')
+        except websockets.exceptions.ConnectionClosed:
+            print("❌ Connexion perdue pendant l'envoi, la requête sera rejouée après reconnexion")
+            self._set_connected(False)
+            self._schedule_recover()
+
+    def _arm_timeout(self, request_id, entry):
+        """(Ré)armer le délai de réponse de `entry` : à échéance, la requête échoue"""
+        timeout = WEBSOCKET_CONFIG['response_timeout']
+        if not timeout:
+            return
+        if entry.timer is not None:
+            entry.timer.cancel()
+        entry.timer = asyncio.get_running_loop().call_later(
+            timeout, self._fail, request_id,
+            asyncio.TimeoutError(f"Aucune réponse du backend depuis {timeout:.0f} s")
+        )
+
+    def _cancel_remote(self, request_id):
+        """Demander au backend d'abandonner une requête dont la réponse n'est plus attendue"""
+        if not self.connected or self.websocket is None:
+            return
+        CANCELLED.inc(transport='websocket')
+        # Envoi en tâche de fond : l'appelant est souvent une tâche en cours d'annulation
+        task = asyncio.ensure_future(self._send_cancel(request_id))
+        self._cancel_tasks.add(task)
+        task.add_done_callback(self._cancel_tasks.discard)
+
+    async def _send_cancel(self, request_id):
+        frame = {"type": CANCEL_FRAME_TYPE, "request_id": request_id}
+        if self._session_id:
+            frame["session_id"] = self._session_id
+        try:
+            await self.websocket.send(self.codec.encode(frame))
+        except Exception as e:
+            # Socket déjà fermé : le backend abandonne alors de lui-même
+            print(f"⚠️ Trame d'annulation non envoyée ({request_id}) : {type(e).__name__}")
+
+    def _dispatch(self, response_data):
+        """Remettre une trame à la requête qui l'attend (Future ou file de streaming)"""
+        request_id = response_data.get('request_id') if isinstance(response_data, dict) else None
+        entry = self._pending.get(request_id) if request_id else None
+        
+        # Backend qui ne renvoie pas le request_id : on sert la plus ancienne requête
+        if entry is None and request_id is None and self._pending:
+            request_id = next(iter(self._pending))
+            entry = self._pending[request_id]
+        
+        if entry is None:
+            print(f"⚠️ Réponse sans requête correspondante ignorée : {request_id}")
+            return
+        
+        self._observe(entry, response_data)
+        self._arm_timeout(request_id, entry)
+        target = entry.target
+        if isinstance(target, asyncio.Queue):
+            if not is_final_frame(response_data):
+                # Après une reprise, les fragments déjà remis sont ignorés : indice `seq`
+                # fourni par le backend, sinon position comptée depuis `resume_from`
+                index = response_data.get('seq', entry.seen)
+                entry.seen += 1
+                if not isinstance(index, int) or index < entry.received:
+                    return
+                entry.received = index + 1
+            target.put_nowait(response_data)
+            if is_final_frame(response_data):
+                self._pending.pop(request_id, None)
+        else:
+            self._pending.pop(request_id, None)
+            if not target.done():
+                target.set_result(response_data)
+
+    @staticmethod
+    def _observe(entry, response_data):
+        """Mesurer le délai de première trame et de réponse complète d'une requête"""
+        if entry.sent_at is None:
+            return
+        elapsed = time.perf_counter() - entry.sent_at
+        if not entry.answered:
+            entry.answered = True
+            FIRST_BYTE_SECONDS.observe(elapsed, transport='websocket')
+        if is_final_frame(response_data):
+            RESPONSE_SECONDS.observe(elapsed, transport='websocket')
+            if response_data.get('status') == 'error':
+                ERRORS.inc(stage='backend')
+
+    def _fail(self, request_id, error: Exception):
+        """Débloquer une requête en attente avec une erreur"""
+        entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return
+        if entry.timer is not None:
+            entry.timer.cancel()
+        ERRORS.inc(stage='timeout' if isinstance(error, asyncio.TimeoutError) else 'connection')
+        if isinstance(entry.target, asyncio.Queue):
+            entry.target.put_nowait(error)
+        elif not entry.target.done():
+            entry.target.set_exception(error)
+
+    def _fail_pending(self, error: Exception):
+        """Débloquer toutes les requêtes en attente avec une erreur"""
+        for request_id in list(self._pending):
+            self._fail(request_id, error)
+
+    def _build_payload(self, message: str, request_id: str, stream: bool = False, trace_id: str = None):
+        """Préparer le message avec les informations de session"""
+        message_payload = {
+            "query": message,
+            "user_id": self.user_id,
+            "model_id": self.model_id,
+            "request_id": request_id
+        }
+        if stream:
+            message_payload["stream"] = True
+        
+        # Ajouter l'ID de session si disponible
+        if self._session_id:
+            message_payload["session_id"] = self._session_id
+        if trace_id:
+            message_payload["trace_id"] = trace_id
+        return message_payload
+
+    def _unavailable(self):
+        """Réponse d'erreur quand le disjoncteur refuse toute connexion, sinon None"""
+        if self.breaker.allow():
+            return None
+        return {
+            'status': 'error',
+            'message': f"Service momentanément indisponible, réessayez dans {self.breaker.retry_in():.0f} s"
+        }
+
+    def _cacheable(self, message: str) -> bool:
+        """Les commandes (changement d'agent) ne passent jamais par le cache"""
+        return not message.startswith(SWITCH_AGENT_COMMAND)
+
+    async def send_message(self, message: str):
+        """Envoyer un message et retourner la réponse, éventuellement depuis le cache"""
+        if self._cacheable(message):
+            cached = self.cache.get(message, self.model_id, self.agent)
+            if cached is not None:
+                return dict(cached)
+
+        if self._cacheable(message):
+            # Requêtes identiques en vol : un seul appel au backend
+            key = single_flight.key(message, self.model_id, self.agent)
+            response = await single_flight.do(key, partial(self._send_message, message))
+        else:
+            response = await self._send_message(message)
+
+        if isinstance(response, dict) and response.get('status') == 'success':
+            if message.startswith(SWITCH_AGENT_COMMAND):
+                self.agent = message[len(SWITCH_AGENT_COMMAND):].strip() or self.agent
+            elif (response.get('data') or {}).get('response'):
+                self.cache.set(message, self.model_id, self.agent, {
+                    key: value for key, value in response.items() if key != 'request_id'
+                })
+        return response
+
+    async def _send_message(self, message: str):
+        self.last_used = time.monotonic()
+        if not self.connected:
+            success = await self.connect()
+            if not success:
+                return self._unavailable()
+
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = _Outbound(message, False, future, current_trace_id())
+        # Sans réponse dans le délai, la requête échoue au lieu d'attendre indéfiniment
+        self._arm_timeout(request_id, self._pending[request_id])
+
+        try:
+            with span('backend.websocket', request_id=request_id):
+                await self._send_payload(request_id, self._pending[request_id])
+                
+                # La boucle de lecture résout le Future à l'arrivée de la réponse,
+                # y compris après une reconnexion (voir _recover)
+                return await future
+        
+        except ConnectionError as e:
+            print(f"❌ Connexion perdue : {str(e)}")
+            return None
+        except asyncio.TimeoutError as e:
+            print(f"⏱️ Délai de réponse dépassé : {request_id}")
+            return {'status': 'error', 'message': str(e)}
+        except Exception as e:
+            print(f"❌ Erreur lors de l'envoi du message : {type(e).__name__} - {str(e)}")
+            self._set_connected(False)
+            return None
+        finally:
+            entry = self._pending.pop(request_id, None)
+            if entry is not None and entry.timer is not None:
+                entry.timer.cancel()
+            # Appelant annulé avant la réponse (l'annulation de la tâche annule aussi le Future) :
+            # le backend peut cesser de la générer
+            if not future.done() or future.cancelled():
+                self._cancel_remote(request_id)
+
+    async def stream_message(self, message: str):
+        """Envoyer un message en mode streaming et produire les trames au fil de l'eau.
+
+        Les trames {'type': 'delta'} sont produites une à une ; la première
+        trame d'un autre type (succès complet, erreur, fin) termine le flux,
+        ce qui reste compatible avec un backend qui ignore le mode streaming.
+        En cas de succès en cache, une seule trame complète est produite.
+        """
+        cacheable = self._cacheable(message)
+        cached = self.cache.get(message, self.model_id, self.agent) if cacheable else None
+        if cached is not None:
+            yield dict(cached)
+            return
+
+        if cacheable:
+            key = single_flight.key(message, self.model_id, self.agent)
+            frames = single_flight.stream(key, partial(self._stream_message, message))
+        else:
+            frames = self._stream_message(message)
+
+        parts = []
+        agent = None
+        async for frame in frames:
+            yield frame
+            if not isinstance(frame, dict):
+                continue
+            data = frame.get('data') or {}
+            agent = data.get('agent') or agent
+            if frame.get('type') == DELTA_FRAME_TYPE:
+                parts.append(data.get('delta', ''))
+            elif frame.get('status') == 'error':
+                return
+            elif data.get('response'):
+                parts = [data['response']]
+
+        if parts and cacheable:
+            data = {'response': ''.join(parts)}
+            if agent:
+                data['agent'] = agent
+            self.cache.set(message, self.model_id, self.agent, {'status': 'success', 'data': data})
+
+    async def _stream_message(self, message: str):
+        self.last_used = time.monotonic()
+        if not self.connected:
+            success = await self.connect()
+            if not success:
+                unavailable = self._unavailable()
+                raise ConnectionError(unavailable['message'] if unavailable else "Connexion WebSocket impossible")
+
+        request_id = uuid.uuid4().hex
+        queue = asyncio.Queue()
+        self._pending[request_id] = _Outbound(message, True, queue, current_trace_id())
+        self._arm_timeout(request_id, self._pending[request_id])
+
+        finished = False
+        try:
+            with span('backend.websocket.stream', request_id=request_id):
+                await self._send_payload(request_id, self._pending[request_id])
+                
+                while True:
+                    frame = await queue.get()
+                    if isinstance(frame, Exception):
+                        finished = True
+                        raise frame
+                    self.last_used = time.monotonic()
+                    finished = is_final_frame(frame)
+                    yield frame
+                    if finished:
+                        return
+        finally:
+            entry = self._pending.pop(request_id, None)
+            if entry is not None and entry.timer is not None:
+                entry.timer.cancel()
+            # Flux abandonné (annulation, générateur fermé) : le backend peut l'interrompre
+            if not finished:
+                self._cancel_remote(request_id)
+
+    async def close(self):
+        # Requêtes encore en vol : prévenir le backend avant de fermer le socket
+        for request_id in list(self._pending):
+            self._cancel_remote(request_id)
+        if self._cancel_tasks:
+            await asyncio.gather(*self._cancel_tasks, return_exceptions=True)
+        self._fail_pending(ConnectionError("Client WebSocket fermé"))
+        if self._reader_task and not self._reader_task.done():
+            self._reader_task.cancel()
+        if self.websocket:
+            await self.websocket.close()
+            self._set_connected(False)
+            self._session_id = None
+
+
+class WebSocketClientPool:
+    """Pool de clients WebSocket indexé par session Panel (ou utilisateur).
+
+    Limite le nombre de sockets ouverts et ferme les clients inactifs depuis
+    plus de `idle_ttl` secondes ou les moins récemment utilisés lorsque
+    `max_clients` est atteint. Un client avec des requêtes en vol n'est
+    jamais évincé : la limite peut alors être dépassée temporairement.
+    """
+
+    def __init__(self, max_clients=POOL_CONFIG['max_clients'], idle_ttl=POOL_CONFIG['idle_ttl'],
+                 **client_kwargs):
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self.client_kwargs = client_kwargs
+        self._clients = OrderedDict()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def acquire(self, key, user_id, **kwargs) -> WebSocketClient:
+        """Retourner le client associé à `key`, en le créant si nécessaire"""
+        client = self._clients.get(key)
+        if client is None:
+            self._evict()
+            client = WebSocketClient(user_id=user_id, **{**self.client_kwargs, **kwargs})
+            self._clients[key] = client
+        else:
+            self._clients.move_to_end(key)
+        client.last_used = time.monotonic()
+        return client
+
+    def release(self, key):
+        """Retirer le client de `key` du pool et fermer son socket"""
+        client = self._clients.pop(key, None)
+        if client is not None:
+            self._schedule_close(client)
+
+    def _evict(self):
+        """Fermer les clients expirés puis les moins récemment utilisés"""
+        now = time.monotonic()
+        for key, client in list(self._clients.items()):
+            if not client.busy and now - client.last_used > self.idle_ttl:
+                print(f"♻️ Client WebSocket inactif fermé : {key}")
+                self.release(key)
+
+        while len(self._clients) >= self.max_clients:
+            idle = next((key for key, client in self._clients.items() if not client.busy), None)
+            if idle is None:
+                print("⚠️ Pool WebSocket saturé : tous les clients sont occupés")
+                break
+            print(f"♻️ Client WebSocket évincé (LRU) : {idle}")
+            self.release(idle)
+
+    @staticmethod
+    def _schedule_close(client):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Hors boucle asyncio, le client n'a jamais pu ouvrir de socket
+            return
+        loop.create_task(client.close())
+
+    async def close_all(self):
+        """Fermer tous les clients du pool"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+
+# Pool partagé par toutes les sessions du serveur
+websocket_pool = WebSocketClientPool(
+    host=WEBSOCKET_CONFIG['host'],
+    port=WEBSOCKET_CONFIG['port'],
+    path=WEBSOCKET_CONFIG['path']
+)